@@ -0,0 +1,324 @@
+from pathlib import Path
+import hashlib
+import json
+import posixpath
+import re
+from manifest import hash_bytes
+from minify import minify
+from publish import prepare_output
+
+# Length of the content hash embedded in fingerprinted filenames
+FINGERPRINT_LENGTH = 8
+
+# url(...) references inside stylesheets, including those used by @import
+CSS_URL_PATTERN = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+# @import url('x.css') screen; / @import "x.css";
+CSS_IMPORT_PATTERN = re.compile(
+    r"""@import\s+(?:url\(\s*(['"]?)([^'")]+)\1\s*\)|(['"])([^'"]+)\3)\s*([^;]*);"""
+)
+CSS_STRING_PATTERN = re.compile(r""""(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'""")
+CSS_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+ASSET_MANIFEST_NAME = "asset-manifest.json"
+CSS_CACHE_DIR = Path(".cache/css")
+
+# Bump to invalidate cached bundles after changing the bundler or minifier
+CSS_BUNDLER_VERSION = 1
+
+
+def fingerprinted_name(logical_path, content):
+    """styles.css + content -> styles.3f9a1c2b.css"""
+    path = Path(logical_path)
+    fingerprint = hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+    return (path.parent / f"{path.stem}.{fingerprint}{path.suffix}").as_posix()
+
+
+def is_external_reference(reference):
+    return reference.startswith(("data:", "http://", "https://", "//", "#", "/"))
+
+
+def rebase_css_urls(css, from_dir, to_dir):
+    """Rewrite relative url(...) references so they still resolve when the CSS moves from from_dir to to_dir"""
+
+    def replace(match):
+        quote, reference = match.groups()
+        if is_external_reference(reference):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(from_dir, reference))
+        return f"url({quote}{posixpath.relpath(target, to_dir or '.')}{quote})"
+
+    return CSS_URL_PATTERN.sub(replace, css)
+
+
+def resolve_css_imports(static_dir, logical_path, seen=None):
+    """
+    Inline every @import of a stylesheet, recursively.
+
+    Returns the bundled CSS and the logical paths of every file it was built from.
+    """
+    seen = set() if seen is None else seen
+    seen.add(logical_path)
+    css_dir = posixpath.dirname(logical_path)
+    with open(Path(static_dir) / logical_path, "r", encoding="utf-8") as f:
+        css = f.read()
+    sources = [logical_path]
+
+    def replace(match):
+        reference = match.group(2) or match.group(4)
+        media = match.group(5).strip()
+        if is_external_reference(reference):
+            return match.group(0)
+        imported_path = posixpath.normpath(posixpath.join(css_dir, reference))
+        if imported_path in seen:
+            return ""
+
+        imported_css, imported_sources = resolve_css_imports(static_dir, imported_path, seen)
+        sources.extend(imported_sources)
+        imported_css = rebase_css_urls(imported_css, posixpath.dirname(imported_path), css_dir)
+        return f"@media {media}{{{imported_css}}}" if media else imported_css
+
+    return CSS_IMPORT_PATTERN.sub(replace, css), sources
+
+
+def minify_css(css):
+    """Strip comments and whitespace that don't change what a stylesheet means"""
+    # Keep strings exactly as written while the rest is squeezed
+    strings = []
+
+    def stash(match):
+        strings.append(match.group(0))
+        return f"\x00{len(strings) - 1}\x00"
+
+    css = CSS_STRING_PATTERN.sub(stash, css)
+    css = CSS_COMMENT_PATTERN.sub("", css)
+    css = re.sub(r"\s+", " ", css)
+    # No space before ":" since "a :hover" and "a:hover" mean different things
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    css = css.replace(";}", "}").strip()
+    return re.sub(r"\x00(\d+)\x00", lambda match: strings[int(match.group(1))], css)
+
+
+def bundle_css(static_dir, logical_path):
+    """
+    Resolve a stylesheet's @imports into a single minified bundle.
+
+    Bundles are cached in .cache/css keyed by the hashes of every file they are
+    built from, so unchanged stylesheets are never re-bundled.
+    """
+    css, sources = resolve_css_imports(static_dir, logical_path)
+    key = hash_bytes(
+        CSS_BUNDLER_VERSION,
+        logical_path,
+        *[hash_bytes((Path(static_dir) / source).read_bytes()) for source in sources],
+    )
+    cached = CSS_CACHE_DIR / f"{key[:32]}.css"
+    if cached.exists():
+        return cached.read_text(encoding="utf-8")
+
+    bundle = minify_css(css)
+    CSS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cached.write_text(bundle, encoding="utf-8")
+    return bundle
+
+
+class AssetFingerprints:
+    """
+    Content-addressed copies of every static asset.
+
+    Each file in src/static is written a second time under a name that embeds a
+    hash of its contents, so those copies can be cached forever: a changed file
+    gets a new name. Stylesheets are rewritten to point at the fingerprinted
+    names of whatever they reference before they are hashed themselves. The
+    original names are kept for scripts that build asset paths at runtime.
+    """
+
+    def __init__(self, mapping=None):
+        # Logical path relative to static/ -> fingerprinted path relative to static/
+        self.mapping = dict(mapping or {})
+
+    @property
+    def digest(self):
+        return hash_bytes(self.mapping)
+
+    def url(self, logical_path):
+        """Fingerprinted path for a logical asset path, or the path itself if unknown"""
+        return self.mapping.get(logical_path.lstrip("/"), logical_path)
+
+    def rewrite_css(self, logical_path, css):
+        """Point url(...) references in a stylesheet at fingerprinted assets"""
+        css_dir = posixpath.dirname(logical_path)
+
+        def replace(match):
+            quote, reference = match.groups()
+            if is_external_reference(reference):
+                return match.group(0)
+            target = posixpath.normpath(posixpath.join(css_dir, reference.split("?")[0]))
+            if target not in self.mapping:
+                return match.group(0)
+            fingerprinted = posixpath.join(posixpath.dirname(reference), posixpath.basename(self.mapping[target]))
+            return f"url({quote}{fingerprinted}{quote})"
+
+        return CSS_URL_PATTERN.sub(replace, css)
+
+    def build(self, static_dir, output_dir, manifest=None):
+        """Fingerprint every file in static_dir into output_dir and write the asset manifest"""
+        static_dir = Path(static_dir)
+        output_dir = Path(output_dir)
+
+        files = [path for path in static_dir.rglob("*") if path.is_file()]
+        # Stylesheets go last, deepest first, so everything they reference
+        # (including other stylesheets they @import) is fingerprinted before them
+        files.sort(
+            key=lambda path: (
+                path.suffix == ".css",
+                -len(path.relative_to(static_dir).parts),
+                path.as_posix(),
+            )
+        )
+
+        for source in files:
+            logical_path = source.relative_to(static_dir).as_posix()
+            if source.suffix == ".css":
+                # Imports are inlined so a page needs one stylesheet request instead of a chain
+                css = bundle_css(static_dir, logical_path)
+                content = self.rewrite_css(logical_path, css).encode("utf-8")
+            elif source.suffix == ".svg":
+                with open(source, "r", encoding="utf-8") as f:
+                    content = minify(source, f.read()).encode("utf-8")
+            else:
+                with open(source, "rb") as f:
+                    content = f.read()
+
+            self.mapping[logical_path] = fingerprinted_name(logical_path, content)
+            target = output_dir / self.mapping[logical_path]
+            # The name already encodes the content, so it only has to be written once
+            if manifest is None or manifest.needs_update(target, self.mapping[logical_path]):
+                prepare_output(target)
+                with open(target, "wb") as f:
+                    f.write(content)
+
+        manifest_path = output_dir / ASSET_MANIFEST_NAME
+        if manifest is None or manifest.needs_update(manifest_path, self.digest):
+            prepare_output(manifest_path)
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(self.mapping, f, indent=2, sort_keys=True)
+
+
+# Selectors that can't be checked against the page's markup with a simple token test
+ALWAYS_CRITICAL_PATTERN = re.compile(r"^(?:\*|:root|html|body)\b|\[")
+SELECTOR_TOKEN_PATTERN = re.compile(r"([.#]?)(-?[_a-zA-Z][\w-]*)")
+SELECTOR_PSEUDO_PATTERN = re.compile(r"::?[\w-]+(?:\([^)]*\))?")
+HTML_CLASS_PATTERN = re.compile(r'\bclass="([^"]*)"')
+HTML_ID_PATTERN = re.compile(r'\bid="([^"]*)"')
+HTML_TAG_PATTERN = re.compile(r"<([a-zA-Z][\w-]*)")
+
+
+def parse_css_rules(css):
+    """
+    Split minified CSS into (prelude, body) pairs.
+
+    The body of a block at-rule such as @media is itself a list of rules; the body
+    of anything else is the declaration text.
+    """
+    rules = []
+    i = 0
+    while i < len(css):
+        brace = css.find("{", i)
+        semicolon = css.find(";", i)
+        if brace == -1:
+            break
+        # Statement at-rules like @charset have no block
+        if css[i] == "@" and semicolon != -1 and semicolon < brace:
+            rules.append((css[i:semicolon], None))
+            i = semicolon + 1
+            continue
+
+        depth, end = 1, brace + 1
+        while depth and end < len(css):
+            depth += {"{": 1, "}": -1}.get(css[end], 0)
+            end += 1
+        prelude, body = css[i:brace].strip(), css[brace + 1:end - 1]
+        if prelude.startswith(("@media", "@supports", "@layer")):
+            body = parse_css_rules(body)
+        rules.append((prelude, body))
+        i = end
+    return rules
+
+
+def selector_matches(selector, classes, ids, tags):
+    """Whether every class, id and tag in a selector appears somewhere on the page"""
+    selector = selector.strip()
+    if ALWAYS_CRITICAL_PATTERN.search(selector):
+        return True
+    for prefix, name in SELECTOR_TOKEN_PATTERN.findall(SELECTOR_PSEUDO_PATTERN.sub("", selector)):
+        if (prefix == "." and name not in classes) or (prefix == "#" and name not in ids) or (
+            not prefix and name.lower() not in tags
+        ):
+            return False
+    return True
+
+
+class CriticalCSS:
+    """
+    Output filter that inlines the subset of a stylesheet a page actually uses.
+
+    The rules kept are those whose selectors only mention classes, ids and tags
+    present in the page. That is a superset of what is above the fold, but it is
+    usually a small fraction of the bundle and needs no browser to compute. The
+    full stylesheet is still loaded, without blocking rendering.
+    """
+
+    def __init__(self, assets, static_dir, logical_path="styles.css"):
+        self.logical_path = logical_path
+        self.href = assets.url(logical_path)
+        with open(Path(static_dir) / self.href, "r", encoding="utf-8") as f:
+            self.rules = parse_css_rules(f.read())
+
+    @property
+    def digest(self):
+        return hash_bytes(CSS_BUNDLER_VERSION, self.href)
+
+    def select(self, rules, classes, ids, tags):
+        kept = []
+        for prelude, body in rules:
+            if body is None:
+                kept.append(f"{prelude};")
+            elif isinstance(body, list):
+                inner = self.select(body, classes, ids, tags)
+                if inner:
+                    kept.append(f"{prelude}{{{inner}}}")
+            elif prelude.startswith("@"):
+                # @font-face, @keyframes and the like are cheap and can't be matched
+                kept.append(f"{prelude}{{{body}}}")
+            elif any(selector_matches(selector, classes, ids, tags) for selector in prelude.split(",")):
+                kept.append(f"{prelude}{{{body}}}")
+        return "".join(kept)
+
+    def __call__(self, output_path, content):
+        link = re.search(
+            rf'<link rel="stylesheet" href="([^"]*/{re.escape(self.href)})">', content
+        )
+        if not str(output_path).endswith(".html") or link is None:
+            return content
+
+        classes = {name for value in HTML_CLASS_PATTERN.findall(content) for name in value.split()}
+        ids = set(HTML_ID_PATTERN.findall(content))
+        tags = {tag.lower() for tag in HTML_TAG_PATTERN.findall(content)}
+        critical = self.select(self.rules, classes, ids, tags)
+
+        # Inlined url()s resolve against the page rather than the stylesheet
+        href = link.group(1)
+        critical = CSS_URL_PATTERN.sub(
+            lambda match: match.group(0)
+            if is_external_reference(match.group(2))
+            else f"url({match.group(1)}{posixpath.join(posixpath.dirname(href), match.group(2))}{match.group(1)})",
+            critical,
+        )
+        replacement = (
+            f"<style>{critical}</style>"
+            f'<link rel="preload" href="{href}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">'
+            f'<noscript><link rel="stylesheet" href="{href}"></noscript>'
+        )
+        return content[:link.start()] + replacement + content[link.end():]
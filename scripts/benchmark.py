@@ -0,0 +1,595 @@
+from pathlib import Path
+from contextlib import contextmanager
+import argparse
+import calendar
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from PIL import Image
+from profiler import format_bytes
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+REPO_DIR = SCRIPTS_DIR.parent
+
+BENCHMARK_DIR = Path(".cache/benchmark")
+# Baselines are committed, one per machine class and worker count, so every checkout
+# has something to compare against
+BASELINE_DIR = REPO_DIR / "benchmarks"
+
+# Bump to regenerate every corpus after changing what the generator writes
+CORPUS_VERSION = 1
+
+# Number of posts in each named corpus
+CORPORA = {"small": 10, "medium": 1_000, "large": 10_000}
+
+# Inline images are drawn from a shared pool, like screenshots reused across posts
+IMAGE_POOL_SIZE = 8
+
+# Elements in each large header SVG; real diagrams exported from Notion reach this
+LARGE_SVG_ELEMENTS = 20_000
+
+# Posts concatenated into the long post whose edits are timed
+LONG_POST_PARTS = 20
+
+# Differences below this many seconds are noise, whatever the ratio
+NOISE_FLOOR = 0.005
+
+WORDS = (
+    "data model market rate python request response cache index build page feed "
+    "query token vector latency throughput parser render stream batch shard merge "
+    "signal policy forecast yield curve spread volume price option future bond "
+    "server client socket header payload schema table column row graph node edge"
+).split()
+
+TAGS = ["data", "finance", "python", "web", "tools", "math", "scraping", "ml", "notes", "design"]
+
+CODE_SNIPPETS = {
+    "python": '''import requests
+
+def fetch_{name}(url, retries={n}):
+    """Fetch {name} and return the parsed JSON"""
+    for attempt in range(retries):
+        response = requests.get(url, timeout=10)
+        if response.ok:
+            return response.json()
+    raise RuntimeError(f"Could not fetch {{url}}")
+''',
+    "bash": '''# Download the {name} dataset
+curl -sSL "https://example.com/{name}.csv" -o {name}.csv
+wc -l {name}.csv | awk '{{print $1 - {n}}}'
+''',
+    "javascript": '''const {name} = async (url) => {{
+  const response = await fetch(url);
+  const rows = await response.json();
+  return rows.filter((row) => row.value > {n});
+}};
+''',
+}
+
+# The rest of the site (templates, static files, other pages) comes from the real src/
+COPIED_SOURCES = ["templates", "static", "data_metadata.json", "blog/index.html"]
+
+
+def sentence(rng, words=12):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def paragraph(rng):
+    sentences = [sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(3, 6))]
+    word = rng.choice(WORDS)
+    sentences.insert(1, f"The `{word}_{rng.randint(0, 99)}` step is **{rng.choice(WORDS)}** bound, "
+                        f"see [the {word} docs](https://example.com/{word}).")
+    return " ".join(sentences)
+
+
+def latex(rng):
+    a, b, c = rng.sample("abcdefghxyz", 3)
+    inline = f"Here $ {a}_{{i}} + {b}^{{2}} $ grows with $ \\sqrt{{{c}}} $."
+    block = f"$$ P({a}) = \\frac{{\\sum_{{i=1}}^{{{rng.randint(2, 50)}}} {b}_i}}{{{c} + {rng.randint(1, 9)}}} $$"
+    return f"{inline}\n\n{block}"
+
+
+def table(rng):
+    columns = rng.sample(WORDS, 4)
+    rows = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for _ in range(rng.randint(3, 8)):
+        rows.append("| " + " | ".join(f"{rng.random() * 100:.2f}" for _ in columns) + " |")
+    return "\n".join(rows)
+
+
+def code_block(rng):
+    language = rng.choice(list(CODE_SNIPPETS))
+    code = CODE_SNIPPETS[language].format(name=f"{rng.choice(WORDS)}_{rng.randint(0, 999)}", n=rng.randint(1, 9))
+    return f"```{language}\n{code}```"
+
+
+def post_markdown(rng, images):
+    """A post with headings, prose, code, maths, a table and now and then an image"""
+    sections = []
+    for _ in range(rng.randint(3, 6)):
+        parts = [f"## {sentence(rng, rng.randint(3, 6))[:-1]}", paragraph(rng), paragraph(rng)]
+        extras = [code_block, latex, table]
+        rng.shuffle(extras)
+        parts.extend(extra(rng) for extra in extras[:rng.randint(1, 3)])
+        if images and rng.random() < 0.3:
+            parts.append(f"![{rng.choice(WORDS)}](img/{rng.choice(images)})")
+        sections.append("\n\n".join(parts))
+    return "\n\n".join(sections) + "\n"
+
+
+def header_svg(rng, elements):
+    """An SVG diagram with a mix of dark and coloured shapes for process_svg to sort out"""
+    colors = ["#000000", "#111", "rgb(20, 20, 20)", "#3366cc", "#dc3912", "#ff9900", "#109618"]
+    shapes = []
+    for index in range(elements):
+        x, y = rng.randint(0, 1200), rng.randint(0, 630)
+        color = rng.choice(colors)
+        if index % 3 == 0:
+            shapes.append(f'<rect x="{x}" y="{y}" width="{rng.randint(4, 80)}" height="{rng.randint(4, 40)}" fill="{color}"/>')
+        elif index % 3 == 1:
+            shapes.append(f'<circle cx="{x}" cy="{y}" r="{rng.randint(2, 20)}" style="fill: {color}; stroke: none"/>')
+        else:
+            shapes.append(f'<path d="M{x} {y} L{x + rng.randint(-50, 50)} {y + rng.randint(-50, 50)}" stroke="{color}"/>')
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="1200" height="630" viewBox="0 0 1200 630">\n  '
+        + "\n  ".join(shapes)
+        + "\n</svg>\n"
+    )
+
+
+def write_image_pool(img_dir, rng):
+    names = []
+    for index in range(IMAGE_POOL_SIZE):
+        name = f"{rng.getrandbits(32):08x}_image.png"
+        width, height = rng.choice([(1600, 900), (1200, 800), (800, 600), (400, 300)])
+        # Gradients compress like screenshots do; noise would make encoding unrealistically slow
+        gradient = Image.linear_gradient("L").resize((width, height))
+        tint = Image.new("RGB", (width, height), (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+        Image.composite(tint, Image.new("RGB", (width, height), "white"), gradient).save(img_dir / name)
+        names.append(name)
+    return names
+
+
+def copy_site_sources(src_dir):
+    """Copy the real templates and static files next to a synthetic corpus, replacing older copies"""
+    for name in COPIED_SOURCES:
+        source, target = REPO_DIR / "src" / name, src_dir / name
+        if target.is_dir():
+            shutil.rmtree(target)
+        if source.is_dir():
+            shutil.copytree(source, target)
+        elif source.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source, target)
+
+
+def generate_corpus(workspace, posts, large_svgs, seed=0):
+    """
+    Write a synthetic site with `posts` posts into workspace/src and return its metadata.
+
+    The corpus is deterministic for a given seed. The first `large_svgs` posts get
+    header diagrams of LARGE_SVG_ELEMENTS elements; the others get small ones.
+    """
+    rng = random.Random(seed)
+    src_dir = workspace / "src"
+    shutil.rmtree(workspace, ignore_errors=True)
+    md_dir, img_dir = src_dir / "blog/md", src_dir / "blog/img"
+    md_dir.mkdir(parents=True)
+    img_dir.mkdir(parents=True)
+
+    images = write_image_pool(img_dir, rng)
+
+    metadata = []
+    start = calendar.timegm((2020, 1, 1, 0, 0, 0))
+    for index in range(posts):
+        post_id = f"{rng.getrandbits(128):032x}"
+        post_id = "-".join([post_id[:8], post_id[8:12], post_id[12:16], post_id[16:20], post_id[20:]])
+        title = sentence(rng, rng.randint(4, 9))[:-1]
+        created = start + index * 3600 * 7
+        metadata.append({
+            "id": post_id,
+            "name": title,
+            "url": f"{title.lower().replace(' ', '-')}-{index}",
+            "description": sentence(rng, 16),
+            "tags": rng.sample(TAGS, rng.randint(1, 3)),
+            "published": True,
+            "created_time": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(created)),
+            "last_edited_time": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(created + rng.randint(0, 10**7))),
+        })
+
+        with open(md_dir / f"{post_id}.md", "w", encoding="utf-8") as f:
+            f.write(post_markdown(rng, images))
+
+        svg = header_svg(rng, LARGE_SVG_ELEMENTS if index < large_svgs else 40)
+        for suffix in (".svg", ".light.svg"):
+            with open(img_dir / f"{post_id}{suffix}", "w", encoding="utf-8") as f:
+                f.write(svg)
+
+    with open(src_dir / "blog_metadata.json", "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
+def prepare_corpus(name, posts, large_svgs, seed=0):
+    """Return the workspace for a corpus, generating it unless an identical one exists"""
+    workspace = (BENCHMARK_DIR / name).resolve()
+    stamp = {"version": CORPUS_VERSION, "posts": posts, "large_svgs": large_svgs, "seed": seed}
+    stamp_path = workspace / "corpus.json"
+    if stamp_path.exists():
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            if json.load(f) == stamp:
+                # Templates and static files change more often than the corpus
+                copy_site_sources(workspace / "src")
+                return workspace
+
+    print(f"Generating {name} corpus ({posts} posts)...")
+    generate_corpus(workspace, posts, large_svgs, seed)
+    copy_site_sources(workspace / "src")
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        json.dump(stamp, f)
+    return workspace
+
+
+def clear_build(workspace, caches=True):
+    for path in ["published", ".published"] + ([".cache"] if caches else []):
+        path = workspace / path
+        if path.is_symlink():
+            path.unlink()
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def run_build(workspace, workers, incremental=False):
+    """Build the workspace in a fresh interpreter; return wall time and stage timings"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        profile_path = Path(f.name)
+    command = [sys.executable, str(SCRIPTS_DIR / "build.py"), "--workers", str(workers), "--profile-json", str(profile_path)]
+    if incremental:
+        command.append("--incremental")
+
+    started = time.perf_counter()
+    subprocess.run(command, cwd=workspace, check=True, stdout=subprocess.DEVNULL)
+    wall = time.perf_counter() - started
+
+    with open(profile_path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    profile_path.unlink()
+    return {"wall": wall, "stages": {name: stage["wall"] for name, stage in profile["stages"].items()}}
+
+
+def edit_one_post(workspace):
+    """Append a paragraph to one post, as a typical incremental rebuild would see"""
+    md_path = sorted((workspace / "src/blog/md").glob("*.md"))[0]
+    with open(md_path, "a", encoding="utf-8") as f:
+        f.write(f"\nEdited at {time.time_ns()}.\n")
+
+
+def benchmark_builds(workspace, workers, repeat):
+    """
+    Time the full build in the scenarios that matter day to day.
+
+    cold:             nothing cached, as on a fresh checkout or CI runner
+    warm:             full rebuild with the highlight, CSS, image and template caches filled
+    incremental:      --incremental with nothing changed
+    incremental-edit: --incremental after editing a single post
+    """
+    runs = {"cold": [], "warm": [], "incremental": [], "incremental-edit": []}
+    for _ in range(repeat):
+        clear_build(workspace)
+        runs["cold"].append(run_build(workspace, workers))
+        runs["warm"].append(run_build(workspace, workers))
+        runs["incremental"].append(run_build(workspace, workers, incremental=True))
+        edit_one_post(workspace)
+        runs["incremental-edit"].append(run_build(workspace, workers, incremental=True))
+    # The fastest run is the one least disturbed by everything else on the machine
+    return {scenario: min(results, key=lambda result: result["wall"]) for scenario, results in runs.items()}
+
+
+@contextmanager
+def working_directory(path):
+    previous = Path.cwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def time_best(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def benchmark_stages(workspace, large_svgs, repeat):
+    """Time the pipeline's heaviest functions on their own, each into a scratch directory"""
+    import build
+    from mathml import to_mathml
+    from process_svg import theme_svg
+
+    stages = {}
+    with working_directory(workspace), tempfile.TemporaryDirectory(dir=workspace) as scratch:
+        publish_dir, src_dir = Path(scratch), Path("src")
+        (publish_dir / "blog").mkdir()
+        with open(src_dir / "blog_metadata.json", "r", encoding="utf-8") as f:
+            blog_posts = json.load(f)
+
+        # Posts link to fingerprinted assets, so those have to exist first
+        build.ASSETS.build(src_dir / "static", publish_dir / "static")
+        build.ROUTES.reset(publish_dir)
+
+        def convert_posts(cold):
+            if cold:
+                # Nothing on disk or in memory from earlier renders: blocks, formulas,
+                # highlighted code, compiled templates
+                shutil.rmtree(".cache", ignore_errors=True)
+                to_mathml.cache_clear()
+                build._env = None
+            for post in blog_posts:
+                build.convert_markdown_to_html(
+                    src_dir / "blog/md" / f"{post['id']}.md", post, publish_dir / "blog"
+                )
+
+        # Cold starts from nothing; warm finds every block cached, like a full build after an edit
+        stages["convert_markdown_to_html"] = time_best(lambda: convert_posts(cold=True), repeat)
+        stages["convert_markdown_to_html_warm"] = time_best(lambda: convert_posts(cold=False), repeat)
+        stages.update(benchmark_long_post(
+            [src_dir / "blog/md" / f"{post['id']}.md" for post in blog_posts[:LONG_POST_PARTS]],
+            Path(scratch) / "blocks",
+            repeat,
+        ))
+        search_stages, search_index = benchmark_search(publish_dir, build.search_documents(
+            blog_posts, src_dir / "blog/md", publish_dir / "blog"
+        ), repeat)
+        stages.update(search_stages)
+        stages["generate_feeds"] = time_best(
+            lambda: build.generate_feeds(blog_posts, publish_dir), repeat
+        )
+        stages["generate_sitemap"] = time_best(
+            lambda: build.generate_sitemap(publish_dir), repeat
+        )
+
+        svg_files = []
+        for post in blog_posts[:max(1, large_svgs)]:
+            svg_file = publish_dir / f"{post['id']}.svg"
+            shutil.copy2(src_dir / "blog/img" / f"{post['id']}.svg", svg_file)
+            svg_files.append(svg_file)
+        stages["process_svg"] = time_best(lambda: [theme_svg(svg_file) for svg_file in svg_files], repeat)
+
+    return stages, search_index
+
+
+def benchmark_long_post(md_files, cache_dir, repeat):
+    """Time rendering one long post whole, and again block by block after a one-paragraph edit"""
+    import build
+    from blocks import BlockRenderer
+
+    text = "\n\n".join(path.read_text(encoding="utf-8") for path in md_files)
+    markdowner = build.get_markdowner()
+    renderer = BlockRenderer(markdowner, cache_dir=cache_dir)
+    renderer.convert(text, "long-post.md")
+
+    edits = iter(range(repeat))
+
+    def render_edited():
+        edited = text.replace("\n\n", f"\n\nEdited paragraph {next(edits)}.\n\n", 1)
+        renderer.convert(edited, "long-post.md")
+
+    return {
+        "markdown_long_post_whole": time_best(lambda: markdowner.convert(text), repeat),
+        "markdown_long_post_one_edit": time_best(render_edited, repeat),
+    }
+
+
+def benchmark_search(publish_dir, documents, repeat):
+    """Time building, updating and querying the search index of rendered posts, and measure its size"""
+    from manifest import hash_file
+    from search import SearchIndex, SearchReader
+
+    cache_dir = publish_dir.parent / "search-cache"
+    search_dir = publish_dir / "search"
+    # Builds take page digests from the manifest; hash up front so neither run pays for it
+    documents = [
+        (post_id, page, url, title, tags, hash_file(page))
+        for post_id, page, url, title, tags, _ in documents
+    ]
+
+    def index_all():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        shutil.rmtree(search_dir, ignore_errors=True)
+        index = SearchIndex(cache_dir)
+        index.update(publish_dir, documents)
+        index.save()
+
+    stages = {"search_index_full": time_best(index_all, repeat)}
+
+    edits = iter(range(repeat))
+
+    def index_one_edit():
+        post_id, page, url, title, tags, _ = documents[0]
+        content = page.read_text(encoding="utf-8").replace("</article>", f"<p>edited{next(edits)}</p></article>", 1)
+        page.write_text(content, encoding="utf-8")
+        documents[0] = (post_id, page, url, title, tags, hash_file(page))
+        index = SearchIndex(cache_dir)
+        index.update(publish_dir, documents)
+        index.save()
+
+    stages["search_index_one_edit"] = time_best(index_one_edit, repeat)
+
+    # Single words, several words and a prefix being typed, each against a cold
+    # reader as on a fresh page load, then again once its shards are loaded
+    rng = random.Random(0)
+    queries = [rng.choice(WORDS) for _ in range(10)]
+    queries += [f"{rng.choice(WORDS)} {rng.choice(WORDS)}" for _ in range(10)]
+    queries += [rng.choice(WORDS)[:3] for _ in range(10)]
+
+    def query_cold():
+        for query in queries:
+            SearchReader(search_dir).search(query)
+
+    reader = SearchReader(search_dir)
+    stages["search_query_cold"] = time_best(query_cold, repeat) / len(queries)
+    stages["search_query_warm"] = time_best(lambda: [reader.search(query) for query in queries], repeat) / len(queries)
+
+    shards = [path.stat().st_size for path in (search_dir / "terms").glob("*.bin")]
+    files = [path.stat().st_size for path in search_dir.rglob("*") if path.is_file()]
+    index = {
+        "bytes": sum(files),
+        "shards": len(shards),
+        "largest_shard_bytes": max(shards, default=0),
+        "pages_bytes": sum(page.stat().st_size for _, page, *_ in documents),
+    }
+    return stages, index
+
+
+def flatten(results):
+    """{"medium/warm": 1.2, "medium/warm/render posts": 0.8, "medium/stage/...": ...}"""
+    metrics = {}
+    for corpus, result in results.items():
+        for scenario, run in result["builds"].items():
+            metrics[f"{corpus}/{scenario}"] = run["wall"]
+            for stage, wall in run["stages"].items():
+                metrics[f"{corpus}/{scenario}/{stage}"] = wall
+        for stage, wall in result["stages"].items():
+            metrics[f"{corpus}/stage/{stage}"] = wall
+    return metrics
+
+
+def compare(current, baseline, threshold):
+    """Print current timings next to the baseline's and return the names of regressions"""
+    current, previous = flatten(current["results"]), flatten(baseline["results"])
+    rows = [("metric", "baseline ms", "current ms", "change")]
+    regressions = []
+    for name, value in current.items():
+        if name not in previous:
+            rows.append((name, "", f"{value * 1000:.1f}", "new"))
+            continue
+        before = previous[name]
+        change = (value - before) / before if before else 0.0
+        marker = ""
+        if abs(value - before) >= NOISE_FLOOR:
+            if change > threshold:
+                marker = "  SLOWER"
+                regressions.append(name)
+            elif change < -threshold:
+                marker = "  faster"
+        rows.append((name, f"{before * 1000:.1f}", f"{value * 1000:.1f}", f"{change:+.1%}{marker}"))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join([row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:3], widths[1:3])] + [row[3]]))
+    return regressions
+
+
+def print_results(results):
+    for name, value in flatten(results["results"]).items():
+        print(f"{name:<60} {value * 1000:>10.1f} ms")
+
+
+def machine_class():
+    return f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs"
+
+
+def baseline_path(workers):
+    """benchmarks/linux-x86_64-8cpu-1worker.json for this machine"""
+    name = f"{platform.system()}-{platform.machine()}-{os.cpu_count()}cpu-{workers}worker".lower()
+    return BASELINE_DIR / f"{name}.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the build on synthetic corpora and compare against a stored baseline"
+    )
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        choices=list(CORPORA),
+        help="Corpus to benchmark, can be repeated (default: small and medium; large has 10k posts and takes a while)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the fastest one is kept")
+    parser.add_argument("--workers", type=int, default=1, help="Passed on to build.py --workers")
+    parser.add_argument(
+        "--large-svgs",
+        type=int,
+        default=1,
+        help=f"Posts whose header is a {LARGE_SVG_ELEMENTS}-element SVG",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus generator")
+    parser.add_argument("--skip-builds", action="store_true", help="Only time the individual stages")
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON to this path")
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="Baseline to compare against (default: the one in benchmarks/ for this machine class and worker count)",
+    )
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as a regression (exit status 1)",
+    )
+    args = parser.parse_args()
+    args.baseline = args.baseline or baseline_path(args.workers)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    corpora = args.corpus or ["small", "medium"]
+
+    results = {
+        "python": platform.python_version(),
+        "machine": machine_class(),
+        "workers": args.workers,
+        "results": {},
+    }
+    for name in corpora:
+        workspace = prepare_corpus(name, CORPORA[name], args.large_svgs, args.seed)
+        print(f"Benchmarking {name} corpus ({CORPORA[name]} posts)...")
+        builds = {} if args.skip_builds else benchmark_builds(workspace, args.workers, args.repeat)
+        stages, search_index = benchmark_stages(workspace, args.large_svgs, args.repeat)
+        results["results"][name] = {
+            "posts": CORPORA[name],
+            "builds": builds,
+            "stages": stages,
+            "search_index": search_index,
+        }
+        print(
+            f"Search index: {format_bytes(search_index['bytes'])} in {search_index['shards']} shards "
+            f"(largest {format_bytes(search_index['largest_shard_bytes'])}) "
+            f"for {format_bytes(search_index['pages_bytes'])} of posts"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    regressions = []
+    if args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != results["machine"] or baseline.get("workers") != results["workers"]:
+            print(f"Note: the baseline was recorded on {baseline.get('machine')} with {baseline.get('workers')} workers")
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+    else:
+        print_results(results)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    sys.exit(1 if regressions else 0)
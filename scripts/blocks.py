@@ -0,0 +1,237 @@
+from pathlib import Path
+import argparse
+import difflib
+import importlib.metadata
+import json
+import os
+import re
+import sys
+from markdown2 import Markdown
+from manifest import build_salt, hash_bytes
+
+BLOCK_CACHE_DIR = Path(".cache/blocks")
+
+# Bump after changing how documents are split or stitched
+BLOCK_CACHE_VERSION = 2
+
+# Packages whose output ends up in rendered blocks
+DEPENDENCY_VERSIONS = {
+    name: importlib.metadata.version(name) for name in ("markdown2", "pygments", "latex2mathml")
+}
+
+FENCE_PATTERN = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+FENCED_BLOCK_PATTERN = re.compile(r"^ {0,3}(`{3,}|~{3,}).*?^ {0,3}\1[^\n]*$", re.MULTILINE | re.DOTALL)
+LIST_ITEM_PATTERN = re.compile(r"^ {0,3}([*+-]|\d+[.)])\s")
+# Link definitions as markdown2 strips them before rendering: [id]: url "title"
+LINK_DEFINITION_PATTERN = re.compile(
+    r"""^ {0,3}\[(.+)\]:[ \t]*\n?[ \t]*<?(.+?)>?[ \t]*(?:\n?[ \t]*(?<=\s)['"(][^\n]*['")][ \t]*)?(?:\n+|\Z)""",
+    re.MULTILINE,
+)
+# Raw HTML blocks may contain blank lines; they end at their closing tag. The tags
+# are the ones markdown2 itself treats as blocks
+HTML_BLOCK_PATTERN = re.compile(rf"^<({Markdown._block_tags_a})\b", re.IGNORECASE)
+
+
+def continues(block, line):
+    """Whether line, after a blank line, still belongs to the block before it"""
+    first = block[0]
+    if line[0] in " \t":
+        # Indented code, or more of a list item
+        return True
+    if LIST_ITEM_PATTERN.match(first) and LIST_ITEM_PATTERN.match(line):
+        # The same list, with blank lines between its items
+        return True
+    if first.startswith(">"):
+        # markdown2 lets a blockquote with indented code in it run on to the end
+        # of the document
+        return line.startswith(">") or any(part[:1] in (" ", "\t") for part in block[1:])
+    joined = "\n".join(block)
+    if joined.rfind("<!--") > joined.rfind("-->"):
+        # An HTML comment runs on until it's closed, blank lines and all
+        return True
+    match = HTML_BLOCK_PATTERN.match(first)
+    if match and not re.search(rf"</{match.group(1)}\s*>", joined, re.IGNORECASE):
+        return True
+    return False
+
+
+def outside_fences(text):
+    """(start, end) of the stretches of text that aren't fenced code"""
+    position = 0
+    for match in FENCED_BLOCK_PATTERN.finditer(text):
+        yield position, match.start()
+        position = match.end()
+    yield position, len(text)
+
+
+def split_blocks(text):
+    """
+    Split a markdown document into top-level blocks that render the same on their own.
+
+    Blocks are separated by blank lines, except inside fenced code and $$ formulas,
+    or where the next line continues a list, blockquote, indented code, HTML block
+    or comment.
+
+    Link definitions render to nothing and are dropped, like markdown2 does. A
+    document that links to one of them is one block, since the link and its
+    definition may end up in different blocks. notion2md's [//]: # (...) comments
+    are definitions nothing links to, so they don't stop a post from being split.
+    """
+    # Definitions in fenced code are code
+    ids, parts, position = set(), [], 0
+    for start, end in outside_fences(text):
+        parts.append(text[position:start])
+        for match in LINK_DEFINITION_PATTERN.finditer(text, start, end):
+            ids.add(match.group(1).lower())
+            parts.append(text[start:match.start()])
+            start = match.end()
+        parts.append(text[start:end])
+        position = end
+    if ids:
+        body = "".join(parts)
+        lowered = body.lower()
+        if any(f"[{id}]" in lowered for id in ids):
+            return [text]
+        text = body
+
+    blocks, block = [], []
+    fence = None
+    in_formula = False
+    blank = False
+    for line in text.splitlines():
+        if fence is None and not in_formula and not line.strip():
+            blank = bool(block)
+            continue
+
+        if blank:
+            if continues(block, line):
+                block.append("")
+            else:
+                blocks.append(block)
+                block = []
+            blank = False
+        block.append(line)
+
+        if fence is not None:
+            if line.strip().startswith(fence):
+                fence = None
+        else:
+            match = FENCE_PATTERN.match(line)
+            if match:
+                fence = match.group(1)
+            elif line.count("$$") % 2:
+                in_formula = not in_formula
+    if block:
+        blocks.append(block)
+    return ["\n".join(block) + "\n" for block in blocks]
+
+
+def stitch(rendered):
+    """Join rendered blocks the way markdown2 separates them in a whole document"""
+    return "\n".join(rendered)
+
+
+class BlockRenderer:
+    """
+    Render markdown a top-level block at a time, reusing blocks rendered before.
+
+    Each document keeps its own cache file in .cache/blocks mapping block hashes
+    to HTML. The file only holds the blocks the document had at its last render,
+    so an edit to one paragraph of a long post converts that paragraph alone and
+    the cache never outgrows the posts. With verify set, every document is also
+    rendered whole; differences are reported and the whole render is used.
+    """
+
+    def __init__(self, markdowner, cache_dir=BLOCK_CACHE_DIR, verify=False):
+        self.markdowner = markdowner
+        # Cached blocks are finished HTML, so anything that changes rendering invalidates them
+        self.salt = hash_bytes(BLOCK_CACHE_VERSION, DEPENDENCY_VERSIONS, build_salt(), markdowner.extras)
+        self.cache_dir = Path(cache_dir)
+        self.verify = verify
+        self.mismatches = []
+
+    def cache_path(self, name):
+        return self.cache_dir / f"{hash_bytes(self.salt, str(name))[:32]}.json"
+
+    def load(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def convert(self, text, name):
+        """Render text, the contents of the document called name, to HTML"""
+        parts = split_blocks(text)
+        if not parts:
+            # Nothing but whitespace and comments; markdown2 still gives an empty paragraph
+            return self.markdowner.convert(text)
+
+        path = self.cache_path(name)
+        cached = self.load(path)
+        keys, blocks = [], {}
+        for block in parts:
+            key = hash_bytes(self.salt, block)
+            if key not in blocks:
+                blocks[key] = cached[key] if key in cached else self.markdowner.convert(block)
+            keys.append(key)
+        html = stitch(blocks[key] for key in keys)
+
+        if self.verify:
+            whole = self.markdowner.convert(text)
+            if whole != html:
+                self.mismatches.append(str(name))
+                report_mismatch(name, whole, html)
+                return whole
+
+        if blocks.keys() != cached.keys():
+            # Posts render in parallel, so write under a unique name and move into place
+            path.parent.mkdir(parents=True, exist_ok=True)
+            partial = path.with_name(f"{path.name}.{os.getpid()}.part")
+            with open(partial, "w", encoding="utf-8") as f:
+                json.dump(blocks, f, ensure_ascii=False)
+            partial.replace(path)
+        return html
+
+    def prune(self, names):
+        """Delete the cache files of documents not in names, such as deleted posts"""
+        if not self.cache_dir.exists():
+            return 0
+        keep = {self.cache_path(name).name for name in names}
+        removed = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name not in keep:
+                os.unlink(entry.path)
+                removed += 1
+        return removed
+
+
+def report_mismatch(name, whole, stitched):
+    diff = difflib.unified_diff(
+        whole.splitlines(), stitched.splitlines(), "whole document", "block by block", n=1, lineterm=""
+    )
+    print(f"Block rendering differs for {name}:", file=sys.stderr)
+    for line in list(diff)[:20]:
+        print(f"  {line}", file=sys.stderr)
+
+
+def main():
+    import build
+
+    parser = argparse.ArgumentParser(
+        description="Check that rendering markdown block by block gives the same HTML as rendering it whole"
+    )
+    parser.add_argument("files", nargs="+", type=Path)
+    args = parser.parse_args()
+
+    markdowner = build.get_markdowner()
+    # Blocks come from the build's cache when they're in it, which checks that too
+    renderer = BlockRenderer(markdowner, verify=True)
+    for path in args.files:
+        renderer.convert(path.read_text(encoding="utf-8"), path)
+    print(f"{len(args.files) - len(renderer.mismatches)} of {len(args.files)} documents render identically")
+    sys.exit(1 if renderer.mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,255 @@
 from pathlib import Path
 import shutil
 import json
-from markdown2 import Markdown
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, pass_context
 import datetime
-import random
 import re
-import xml.etree.ElementTree as ET
-from datetime import datetime as dt
+import unicodedata
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from manifest import Manifest, hash_bytes, hash_file
+from images import ResponsiveImages
+from assets import AssetFingerprints, CriticalCSS
+from highlight import HighlightingMarkdown, highlight_filter
+from mathml import MathMLMarkdown, evict as evict_mathml_cache
+from blocks import BlockRenderer
+from minify import MarkupMinifier, minify
+from precompress import precompress
+from publish import StagedPublish, prepare_output
+from profiler import PROFILER, add_profile_arguments, profiled
+from sitemap import RouteRegistry, write_sitemaps
+from search import SearchIndex
+from feeds import BLOG_URL, SITE_URL, archive_path, json_feed, newest_edit, partition_posts, rfc822
+
+JINJA_CACHE_DIR = Path(".cache/jinja")
+PUBLISH_DIR = Path("published")
+
+# Posts per blog index and tag page
+INDEX_PAGE_SIZE = 10
+
+
+class CountingBytecodeCache(FileSystemBytecodeCache):
+    """On-disk cache of compiled templates that keeps track of its hits and misses"""
+
+    def __init__(self, directory):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        super().__init__(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        # The bucket stays empty when nothing was cached or the template source changed
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+
+# Shared by every page rendered in this process
+_env = None
+
+# Fingerprinted static assets, filled in by the asset stage before pages are rendered
+ASSETS = AssetFingerprints()
+
+# Every output of the current build, registered as pages are rendered or skipped
+ROUTES = RouteRegistry()
+
+# Full-text index of the posts, updated after they are rendered
+SEARCH = SearchIndex()
+
+# Sources of the static files, fingerprinted assets and image variants
+ASSET_SOURCES = ("src/static", "src/blog/img", "src/favicon.ico")
+
+# (ResponsiveImages, output keys) of the last in-process build's asset stages, reused
+# by dev rebuilds whose changes don't touch ASSET_SOURCES
+_asset_outputs = None
+
+
+@pass_context
+def asset_url(context, logical_path):
+    """Resolve a path under static/ to its fingerprinted URL for the page being rendered"""
+    return f"{context['static_prefix']}/{ASSETS.url(logical_path)}"
 
 
 def setup_jinja():
-    """Set up Jinja environment"""
-    env = Environment(loader=FileSystemLoader("src/templates"), autoescape=True)
+    """Return the Jinja environment, setting it up on first use"""
+    global _env
+    if _env is not None:
+        return _env
+
+    env = Environment(
+        loader=FileSystemLoader("src/templates"),
+        autoescape=True,
+        bytecode_cache=CountingBytecodeCache(JINJA_CACHE_DIR),
+    )
 
     # Add current year to all templates
     env.globals["now"] = type("", (), {"year": datetime.datetime.now().year})()
 
-    # Random number for cache busting
-    env.globals["cache_bust"] = str(random.randint(0, 1000000))
+    # Content-addressed asset URLs, e.g. {{ asset('styles.css') }}
+    env.globals["asset"] = asset_url
+
+    # Build-time syntax highlighting for code written in templates
+    env.filters["highlight"] = highlight_filter
+
+    # Dates in feeds, e.g. {{ post.last_edited_time | rfc822 }}
+    env.filters["rfc822"] = rfc822
 
     # Add is_homepage flag
     env.globals["is_homepage"] = False
 
+    _env = env
     return env
 
 
+# Post-processing applied to every rendered page before it is written, in order.
+# Each filter is called as filter(output_path, content) and exposes a `digest` of
+# whatever state affects its output, so pages are rebuilt when that state changes.
+OUTPUT_FILTERS = []
+
+
+# Digest of ASSETS and OUTPUT_FILTERS, which stay the same while pages are rendered
+_shared_state = None
+
+
+def shared_state_digest():
+    """Digest of the build-wide state every page depends on besides its own inputs"""
+    global _shared_state
+    if _shared_state is None:
+        _shared_state = hash_bytes(
+            ASSETS.digest, *[output_filter.digest for output_filter in OUTPUT_FILTERS]
+        )
+    return _shared_state
+
+
+def write_output(output_path, content):
+    """Run a rendered page through the output filters and write it"""
+    for output_filter in OUTPUT_FILTERS:
+        with PROFILER.stage(f"filter: {type(output_filter).__name__}"):
+            content = output_filter(output_path, content)
+
+    prepare_output(output_path)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def render_page(template_name, output_path, manifest=None, volatile_context=None, lastmod=None, **context):
+    """
+    Render a template to output_path.
+
+    With a manifest, the page is only rendered when the template (and everything it
+    extends or includes) or the context changed since the last build. Values in
+    volatile_context are passed to the template but left out of that comparison.
+    lastmod is when the page's content last changed, for the sitemap.
+    """
+    ROUTES.add(output_path, lastmod)
+
+    if manifest is not None:
+        digest = hash_bytes(
+            manifest.template_hash(template_name),
+            context,
+            datetime.datetime.now().year,
+            shared_state_digest(),
+        )
+        if not manifest.needs_update(output_path, digest):
+            return None
+
+    with PROFILER.stage("jinja"):
+        env = setup_jinja()
+        template = env.get_template(template_name)
+        html = template.render(**context, **(volatile_context or {}))
+
+    write_output(output_path, html)
+
+    return html
+
+
+class SiteMarkdown(HighlightingMarkdown, MathMLMarkdown):
+    """Markdown with cached code highlighting and LaTeX conversion"""
+
+
+# One Markdown instance per process, reused for every post it renders
+_markdowner = None
+
+
+def get_markdowner():
+    """Return this process's Markdown instance, creating it on first use"""
+    global _markdowner
+    if _markdowner is None:
+        # Fenced code blocks are highlighted here rather than in the browser
+        _markdowner = SiteMarkdown(extras=["fenced-code-blocks", "latex", "tables"])
+    return _markdowner
+
+
+# Renders posts a block at a time through this process's Markdown instance
+_block_renderer = None
+
+
+def get_block_renderer():
+    """Return this process's block renderer, creating it on first use"""
+    global _block_renderer
+    if _block_renderer is None:
+        _block_renderer = BlockRenderer(get_markdowner())
+    return _block_renderer
+
+
+def post_output_path(markdown_file_path, metadata=None, output_dir=Path("blog")):
+    """Return where the HTML for a post is written"""
+    # Use the URL from metadata for the filename, fallback to original name if no metadata
+    if metadata and "url" in metadata:
+        html_filename = f"{metadata['url']}.html"
+    else:
+        html_filename = Path(markdown_file_path).name.replace(".md", ".html")
+
+    return output_dir / html_filename
+
+
+def post_needs_update(markdown_file_path, metadata, html_path, manifest=None):
+    """Return whether a post has to be rendered, recording its digest in the manifest"""
+    if manifest is None:
+        return True
+
+    digest = hash_bytes(
+        manifest.template_hash("blog-post.html"),
+        hash_file(markdown_file_path),
+        metadata,
+        datetime.datetime.now().year,
+        shared_state_digest(),
+    )
+    return manifest.needs_update(html_path, digest)
+
+
+def render_post(markdown_file_path, metadata=None):
+    """Convert a markdown file to a full HTML page and return it without writing anything"""
+    renderer = get_block_renderer()
+    env = setup_jinja()
+    template = env.get_template("blog-post.html")
+
+    # Read markdown and convert to HTML, reusing the blocks unchanged since the last render
+    # Block formulas come out of the converter already in their math-container
+    with open(markdown_file_path) as f, PROFILER.stage("markdown"):
+        content = f.read()
+        html_content = renderer.convert(content, markdown_file_path)
+
+    # Render template
+    with PROFILER.stage("jinja"):
+        return template.render(
+            title=metadata.get("name", "Blog Post") if metadata else "Blog Post",
+            description=metadata.get("description", "") if metadata else "",
+            content=html_content,
+            static_prefix="../static",
+            root_prefix="..",
+            id=metadata.get("id", "") if metadata else "",
+            created_time=metadata.get("created_time", "") if metadata else "",
+            tags=metadata.get("tags", []) if metadata else [],
+        )
+
+
 def convert_markdown_to_html(
-    markdown_file_path, metadata=None, output_dir=Path("blog")
+    markdown_file_path, metadata=None, output_dir=Path("blog"), manifest=None
 ):
     """
     Convert a markdown file to HTML using markdown2 and save it with proper HTML structure.
@@ -35,181 +257,359 @@ def convert_markdown_to_html(
     Args:
         markdown_file_path (str): Path to the markdown file
         metadata (dict, optional): Post metadata including title, description, etc.
+        manifest (Manifest, optional): Skip the post if its inputs are unchanged
     """
-    markdowner = Markdown(extras=["fenced-code-blocks", "latex", "tables"])
-    env = setup_jinja()
-    template = env.get_template("blog-post.html")
+    html_path = post_output_path(markdown_file_path, metadata, output_dir)
+    ROUTES.add(html_path, metadata.get("last_edited_time") if metadata else None)
+    if not post_needs_update(markdown_file_path, metadata, html_path, manifest):
+        return None
 
-    # Read markdown and convert to HTML
-    with open(markdown_file_path) as f:
-        content = f.read()
-        html_content = markdowner.convert(content)
-
-        # Pre-processing steps
-        html_content = re.sub(
-            r'(<math[^>]*display="block"[^>]*>.*?</math>)',
-            r'<div class="math-container">\1</div>',
-            html_content,
-            flags=re.DOTALL,
-        )
+    html = render_post(markdown_file_path, metadata)
 
-    # Render template
-    html = template.render(
-        title=metadata.get("name", "Blog Post") if metadata else "Blog Post",
-        description=metadata.get("description", "") if metadata else "",
-        content=html_content,
-        static_prefix="../static",
-        root_prefix="..",
-        id=metadata.get("id", "") if metadata else "",
-        created_time=metadata.get("created_time", "") if metadata else "",
-        tags=metadata.get("tags", []) if metadata else [],
-    )
+    write_output(html_path, html)
 
-    # Use the URL from metadata for the filename, fallback to original name if no metadata
-    if metadata and "url" in metadata:
-        html_filename = f"{metadata['url']}.html"
+    return html
+
+
+def init_render_worker(asset_mapping, verify_blocks):
+    """Warm up a worker process once so every post it renders reuses the same instances"""
+    # Workers must link the same asset versions as the parent
+    ASSETS.mapping = asset_mapping
+    get_block_renderer().verify = verify_blocks
+    setup_jinja().get_template("blog-post.html")
+
+
+def render_posts(blog_posts, md_dir, output_dir, manifest=None, workers=1):
+    """
+    Render every post in blog_posts, optionally spread over a pool of worker processes.
+
+    Workers only return HTML; all files are written by the parent in the order of
+    blog_posts, so the output is the same regardless of the worker count.
+    """
+    jobs = []
+    for post in blog_posts:
+        markdown_file_path = md_dir / (post["id"] + ".md")
+        html_path = post_output_path(markdown_file_path, post, output_dir)
+        ROUTES.add(html_path, post.get("last_edited_time"))
+        if post_needs_update(markdown_file_path, post, html_path, manifest):
+            jobs.append((markdown_file_path, post, html_path))
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)),
+            initializer=init_render_worker,
+            initargs=(ASSETS.mapping, get_block_renderer().verify),
+        ) as pool:
+            rendered = pool.map(
+                render_post,
+                [markdown_file_path for markdown_file_path, _, _ in jobs],
+                [post for _, post, _ in jobs],
+                chunksize=max(1, len(jobs) // (workers * 4)),
+            )
+            results = list(rendered)
     else:
-        html_filename = Path(markdown_file_path).name.replace(".md", ".html")
+        results = []
+        for markdown_file_path, post, _ in jobs:
+            with PROFILER.item("render posts", post["id"]) as record:
+                results.append(render_post(markdown_file_path, post))
+                record["bytes"] = len(results[-1].encode("utf-8"))
 
-    html_path = output_dir / html_filename
-    with open(html_path, "w", encoding="utf-8") as f:
-        f.write(html)
+    for (_, _, html_path), html in zip(jobs, results):
+        write_output(html_path, html)
 
-    return html
+    return len(jobs)
 
 
-def set_up_directories():
-    """Create and clean the publish directory structure and return the publish and src directories"""
-    publish_dir = Path("published")
-    src_dir = Path("src")
+def search_documents(blog_posts, md_dir, output_dir, manifest=None):
+    """(post id, page, URL, title, tags, digest) of every post for the search index"""
+    documents = []
+    for post in blog_posts:
+        html_path = post_output_path(md_dir / (post["id"] + ".md"), post, output_dir)
+        # The manifest already knows when a page changed, which saves hashing every page
+        digest = manifest.current.get(manifest.key(html_path)) if manifest is not None else None
+        documents.append(
+            (post["id"], html_path, f"/blog/{post['url']}", post.get("name", ""), post.get("tags", []), digest)
+        )
+    return documents
 
-    # Remove existing publish directory if it exists
-    if publish_dir.exists():
-        shutil.rmtree(publish_dir)
 
-    # Create fresh directory structure
-    publish_dir.mkdir()
-    (publish_dir / "blog").mkdir()
+def set_up_directories(publish_dir=PUBLISH_DIR):
+    """Create the publish directory structure and return the publish and src directories"""
+    src_dir = Path("src")
+
+    # Create directory structure
+    publish_dir.mkdir(exist_ok=True)
+    (publish_dir / "blog").mkdir(exist_ok=True)
 
     return publish_dir, src_dir
 
 
-def copy_files(publish_dir, src_dir):
+def copy_file(source, target):
+    """Copy a file, minifying it on the way if it's SVG or XML"""
+    prepare_output(target)
+    if Path(source).suffix in (".svg", ".xml"):
+        with open(source, "r", encoding="utf-8") as f:
+            content = minify(source, f.read())
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(content)
+        shutil.copystat(source, target)
+    else:
+        shutil.copy2(source, target)
+
+
+def copy_tree(source_dir, target_dir, manifest=None):
+    """Copy a directory tree, only copying files whose contents changed when given a manifest"""
+    if manifest is None:
+        shutil.copytree(source_dir, target_dir, dirs_exist_ok=True, copy_function=copy_file)
+        return
+
+    for source in sorted(source_dir.rglob("*")):
+        if not source.is_file():
+            continue
+        target = target_dir / source.relative_to(source_dir)
+        if manifest.needs_update(target, hash_file(source)):
+            target.parent.mkdir(parents=True, exist_ok=True)
+            copy_file(source, target)
+
+
+def copy_files(publish_dir, src_dir, manifest=None):
     """Copy static files to the publish directory"""
 
     # Copy static directory from src
     if (src_dir / "static").exists():
-        shutil.copytree(src_dir / "static", publish_dir / "static")
+        copy_tree(src_dir / "static", publish_dir / "static", manifest)
 
     # Copy blog images
     if (src_dir / "blog/img").exists():
-        shutil.copytree(src_dir / "blog/img", publish_dir / "blog/img")
+        copy_tree(src_dir / "blog/img", publish_dir / "blog/img", manifest)
 
     # Favicon ico goes in the root
     if (src_dir / "favicon.ico").exists():
-        shutil.copy(src_dir / "favicon.ico", publish_dir / "favicon.ico")
+        target = publish_dir / "favicon.ico"
+        if manifest is None or manifest.needs_update(target, hash_file(src_dir / "favicon.ico")):
+            prepare_output(target)
+            shutil.copy(src_dir / "favicon.ico", target)
 
 
-def generate_blog_index(blog_posts, publish_dir, src_dir):
-    """Generate the blog index page listing all posts"""
-    env = setup_jinja()
-    template = env.get_template("blog-index.html")
+def tag_slug(tag):
+    """'Machine Learning' -> 'machine-learning', 'Café' -> 'cafe'; tags with no letters or digits to keep get a hash"""
+    folded = unicodedata.normalize("NFKD", tag).encode("ascii", "ignore").decode("ascii")
+    slug = re.sub(r"[^a-z0-9]+", "-", folded.lower()).strip("-")
+    return slug or f"tag-{hash_bytes(tag)[:8]}"
 
-    sorted_posts = sorted(blog_posts, key=lambda x: x.get("date", ""), reverse=True)
 
-    # Render template
-    html = template.render(
-        title="Blog",
-        description="Controverisal takes, tagged and sorted chronologically",
-        posts=sorted_posts,
-        static_prefix="../static",
-        root_prefix="..",
-    )
+def group_posts(blog_posts):
+    """
+    Every post and the posts of each tag, newest first, from a single pass over the posts.
 
-    # Write the generated index page
-    with open(publish_dir / "blog/index.html", "w", encoding="utf-8") as f:
-        f.write(html)
+    Returns {slug: posts}, with every post under None, and {slug: label}. Tags
+    with the same slug, like "C" and "C++", share one listing labelled with all
+    of their names.
+    """
+    groups, names = {None: []}, {}
+    for post in sorted(blog_posts, key=lambda post: (post.get("created_time", ""), post["id"]), reverse=True):
+        groups[None].append(post)
+        # A post tagged both "C" and "C++" is listed under their slug once
+        slugs = {tag: tag_slug(tag) for tag in post.get("tags", [])}
+        for tag, slug in slugs.items():
+            names.setdefault(slug, set()).add(tag)
+        for slug in dict.fromkeys(slugs.values()):
+            groups.setdefault(slug, []).append(post)
+    return groups, {slug: ", ".join(sorted(tags)) for slug, tags in names.items()}
+
+
+def paginate(posts, page_size=INDEX_PAGE_SIZE):
+    """
+    Split posts (newest first) into {page number: posts} for a listing.
 
+    Page 0 is the front page with the newest posts. Numbered pages are counted
+    from the oldest post and only hold full pages, so a new post changes the front
+    page but never moves posts between numbered pages. There are just enough of
+    them to cover every post not on the front page, so the newest one never
+    repeats the front page exactly.
+    """
+    oldest_first = posts[::-1]
+    pages = {0: posts[:page_size]}
+    for number in range(1, -(-len(posts) // page_size)):
+        pages[number] = oldest_first[(number - 1) * page_size:number * page_size][::-1]
+    return pages
 
-def generate_home(publish_dir):
-    """Generate the homepage"""
-    env = setup_jinja()
-    template = env.get_template("home.html")
 
-    # Set is_homepage to True for the homepage
-    env.globals["is_homepage"] = True
+def listing_path(slug, number):
+    """Output path of a page of the blog index (slug None) or of a tag's listing; 0 is the front page"""
+    if slug is None:
+        return "blog/index.html" if number == 0 else f"blog/page/{number}.html"
+    return f"blog/tag/{slug}.html" if number == 0 else f"blog/tag/{slug}/{number}.html"
+
+
+def listing_url(slug, number):
+    """URL of a listing page relative to the site root, without the .html the server adds"""
+    path = listing_path(slug, number)
+    return "/blog" if path == "blog/index.html" else "/" + path[:-len(".html")]
+
+
+def generate_blog_index(blog_posts, publish_dir, src_dir, manifest=None):
+    """
+    Generate the blog index and a listing per tag, INDEX_PAGE_SIZE posts a page.
 
-    html = template.render(
+    A page's context is only its own posts and links, so with a manifest only the
+    pages whose posts changed are rendered again.
+    """
+    groups, labels = group_posts(blog_posts)
+    tags = sorted((labels[slug], listing_url(slug, 0)) for slug in groups if slug is not None)
+
+    for slug, posts in groups.items():
+        tag = labels.get(slug)
+        pages = paginate(posts)
+        last = len(pages) - 1
+        for number, page_posts in pages.items():
+            if number == 0:
+                older = last
+                newer = None
+            else:
+                older = number - 1
+                newer = number + 1 if number < last else 0
+
+            path = listing_path(slug, number)
+            root_prefix = "/".join([".."] * path.count("/"))
+            title = "Blog" if tag is None else f"Posts tagged {tag}"
+
+            render_page(
+                "blog-index.html",
+                publish_dir / path,
+                manifest=manifest,
+                title=title if number == 0 else f"{title} - page {number}",
+                description="Controverisal takes, tagged and sorted chronologically",
+                lastmod=newest_edit(page_posts),
+                posts=page_posts,
+                tag=tag,
+                tags=tags,
+                page=number,
+                newer_url=listing_url(slug, newer) if newer is not None else None,
+                older_url=listing_url(slug, older) if older else None,
+                static_prefix=f"{root_prefix}/static",
+                root_prefix=root_prefix,
+            )
+
+
+def generate_home(publish_dir, manifest=None):
+    """Generate the homepage"""
+    render_page(
+        "home.html",
+        publish_dir / "index.html",
+        manifest=manifest,
         title="Home",
         description="A digital garden for experiments, thoughts, data and other such mischief.",
         static_prefix="static",
         root_prefix=".",
+        is_homepage=True,
     )
 
-    with open(publish_dir / "index.html", "w", encoding="utf-8") as f:
-        f.write(html)
 
+def write_json_output(output_path, data, manifest=None, lastmod=None):
+    """Write data as JSON, skipping it when the manifest says it's unchanged"""
+    ROUTES.add(output_path, lastmod)
+    content = json.dumps(data, ensure_ascii=False, indent=2)
+    if manifest is None or manifest.needs_update(output_path, hash_bytes(content)):
+        write_output(output_path, content)
 
-def generate_rss_feed(blog_posts, publish_dir):
-    """Generate the RSS feed XML file"""
-    env = setup_jinja()
-    template = env.get_template("rss.xml")
 
-    # Sort posts by last edited time, newest first
-    sorted_posts = sorted(
-        blog_posts, key=lambda x: x.get("last_edited_time", ""), reverse=True
-    )
+def generate_feeds(blog_posts, publish_dir, manifest=None):
+    """
+    Generate the RSS feed and JSON Feed with the most recent posts, and archives of the rest.
 
-    # Render template
-    xml = template.render(posts=sorted_posts, now=datetime.datetime.now())
+    Older posts are moved to RFC 5005 archive documents of ARCHIVE_PAGE_SIZE posts
+    (blog/archive/N.xml, and N.json with next_url paging for JSON Feed). Archives
+    only link back to older ones, so they stay byte-identical once written.
+    """
+    current, pages = partition_posts(blog_posts)
+    newest = len(pages)
+
+    for number, posts in enumerate(pages, start=1):
+        lastmod = newest_edit(posts)
+        previous = f"{SITE_URL}/{archive_path(number - 1, '.xml')}" if number > 1 else None
+        render_page(
+            "rss.xml",
+            publish_dir / archive_path(number, ".xml"),
+            manifest=manifest,
+            lastmod=lastmod,
+            posts=posts,
+            archive=True,
+            self_url=f"{SITE_URL}/{archive_path(number, '.xml')}",
+            prev_archive=previous,
+        )
+        write_json_output(
+            publish_dir / archive_path(number, ".json"),
+            json_feed(
+                posts,
+                f"{SITE_URL}/{archive_path(number, '.json')}",
+                next_url=f"{SITE_URL}/{archive_path(number - 1, '.json')}" if number > 1 else None,
+            ),
+            manifest,
+            lastmod,
+        )
 
-    # Write the RSS feed
-    with open(publish_dir / "blog/rss.xml", "w", encoding="utf-8") as f:
-        f.write(xml)
+    # Only changes when a post does, not on every build
+    lastmod = newest_edit(blog_posts)
+    render_page(
+        "rss.xml",
+        publish_dir / "blog/rss.xml",
+        manifest=manifest,
+        lastmod=lastmod,
+        posts=current,
+        archive=False,
+        self_url=f"{BLOG_URL}/rss.xml",
+        prev_archive=f"{SITE_URL}/{archive_path(newest, '.xml')}" if newest else None,
+        last_build_date=lastmod,
+    )
+    write_json_output(
+        publish_dir / "blog/feed.json",
+        json_feed(
+            current,
+            f"{BLOG_URL}/feed.json",
+            next_url=f"{SITE_URL}/{archive_path(newest, '.json')}" if newest else None,
+        ),
+        manifest,
+        lastmod,
+    )
 
 
-def generate_contact(publish_dir):
+def generate_contact(publish_dir, manifest=None):
     """Generate the contact page"""
-    env = setup_jinja()
-    template = env.get_template("contact.html")
-
-    html = template.render(
+    render_page(
+        "contact.html",
+        publish_dir / "contact.html",
+        manifest=manifest,
         title="Contact",
         description="It's almost like shouting into the void",
         static_prefix="static",
         root_prefix=".",
     )
 
-    with open(publish_dir / "contact.html", "w", encoding="utf-8") as f:
-        f.write(html)
 
-
-def generate_tools(publish_dir):
+def generate_tools(publish_dir, manifest=None):
     """Generate the tools page"""
-    env = setup_jinja()
-    template = env.get_template("tools.html")
-
-    html = template.render(
+    render_page(
+        "tools.html",
+        publish_dir / "tools.html",
+        manifest=manifest,
         title="Tools",
         description="Useful tools for developers and AI enthusiasts",
         static_prefix="static",
         root_prefix=".",
     )
 
-    with open(publish_dir / "tools.html", "w", encoding="utf-8") as f:
-        f.write(html)
-
 
-def generate_data(publish_dir, src_dir):
+def generate_data(publish_dir, src_dir, manifest=None):
     """Generate the data page"""
-    env = setup_jinja()
-    template = env.get_template("data.html")
-
     # Load dataset metadata
     with open(src_dir / "data_metadata.json", "r") as f:
         datasets = json.load(f)
 
-    html = template.render(
+    render_page(
+        "data.html",
+        publish_dir / "data.html",
+        manifest=manifest,
         title="Data Collection",
         description="Curated datasets from various domains, regularly updated and freely available. Each set includes metadata, download options, and mirror links for major platforms.",
         static_prefix="static",
@@ -217,113 +617,250 @@ def generate_data(publish_dir, src_dir):
         datasets=datasets,
     )
 
-    with open(publish_dir / "data.html", "w", encoding="utf-8") as f:
-        f.write(html)
-
 
-def generate_tool_pages(publish_dir):
+def generate_tool_pages(publish_dir, manifest=None):
     """Generate individual tool pages"""
-    env = setup_jinja()
-    
     # Create tools directory
     tools_dir = publish_dir / "tools"
     tools_dir.mkdir(exist_ok=True)
-    
+
     # Generate tokenizer page
-    tokenizer_template = env.get_template("tokenizer.html")
-    tokenizer_html = tokenizer_template.render(
+    render_page(
+        "tokenizer.html",
+        tools_dir / "tokenizer.html",
+        manifest=manifest,
         title="GPT Tokenizer Tool",
         description="Analyze and tokenize text using OpenAI's GPT models",
         static_prefix="../static",
         root_prefix="..",
     )
-    with open(tools_dir / "tokenizer.html", "w", encoding="utf-8") as f:
-        f.write(tokenizer_html)
-    
+
     # Generate dithering page
-    dithering_template = env.get_template("dithering.html")
-    dithering_html = dithering_template.render(
+    render_page(
+        "dithering.html",
+        tools_dir / "dithering.html",
+        manifest=manifest,
         title="Image Dithering Tool",
         description="Create retro dark aesthetics by applying dithering algorithms to your images",
         static_prefix="../static",
         root_prefix="..",
     )
-    with open(tools_dir / "dithering.html", "w", encoding="utf-8") as f:
-        f.write(dithering_html)
 
 
-def generate_logo_page(publish_dir):
+def generate_logo_page(publish_dir, manifest=None):
     """Generate a blank page with centered logo"""
-    env = setup_jinja()
-    template = env.get_template("logo.html")
-
-    html = template.render(
+    render_page(
+        "logo.html",
+        publish_dir / "logo.html",
+        manifest=manifest,
         title="Logo",
         description="",
         static_prefix="static",
         root_prefix=".",
     )
 
-    with open(publish_dir / "logo.html", "w", encoding="utf-8") as f:
-        f.write(html)
 
+def generate_sitemap(publish_dir, manifest=None):
+    """Write sitemap.xml, or a sitemap index and its parts, from the pages this build registered"""
+    write_sitemaps(publish_dir, ROUTES, manifest)
 
-def generate_sitemap(publish_dir, src_dir, blog_posts):
-    """Generate sitemap.xml"""
 
-    sitemap = """<?xml version='1.0' encoding='utf-8'?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">"""
-
-    # Get all HTML files recursively from publish_dir
-    html_files = []
-    for path in publish_dir.rglob("*.html"):
-        # Convert to relative path from publish_dir
-        rel_path = path.relative_to(publish_dir)
-        html_files.append(str(rel_path))
-
-    # Add each URL to sitemap
-    for html_file in html_files:
-        # Clean up the URL: remove index.html and .html suffixes
-        clean_url = html_file
-        if clean_url.endswith("index.html"):
-            clean_url = clean_url[:-10]  # Remove "index.html"
-        elif clean_url.endswith(".html"):
-            clean_url = clean_url[:-5]   # Remove ".html"
-        
-        sitemap += f"\n<url>\n<loc>https://vtasca.dev/{clean_url}</loc>\n</url>"
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the site into published/")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Keep published/ and only rebuild outputs whose inputs changed since the last build",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to render blog posts (0 uses every CPU core)",
+    )
+    parser.add_argument(
+        "--verify-blocks",
+        action="store_true",
+        help="Also render each post as a whole and report on stderr where that differs from rendering it block by block",
+    )
+    parser.add_argument(
+        "--critical-css",
+        action="store_true",
+        help="Inline the stylesheet rules each page uses and load the full bundle without blocking rendering",
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    return args
+
+
+@contextmanager
+def build_stage(name, manifest):
+    """Time a build stage and count the outputs it wrote and their size"""
+    first = len(manifest.rebuilt)
+    with PROFILER.stage(name) as stage:
+        yield stage
+    written = manifest.rebuilt[first:]
+    PROFILER.add(
+        name,
+        count=len(written),
+        bytes=sum(os.path.getsize(manifest.publish_dir / key) for key in written if (manifest.publish_dir / key).exists()),
+    )
 
-    sitemap += "\n</urlset>"
 
-    # Write sitemap file
-    with open(publish_dir / "sitemap.xml", "w", encoding="utf-8") as f:
-        f.write(sitemap)
+def touches_assets(changed_paths):
+    """Whether any of changed_paths is under ASSET_SOURCES"""
+    for path in changed_paths:
+        path = Path(os.path.relpath(path)).as_posix()
+        if any(path == source or path.startswith(source + "/") for source in ASSET_SOURCES):
+            return True
+    return False
 
 
-if __name__ == "__main__":
-    # Set up directories
-    publish_dir, src_dir = set_up_directories()
+def build(
+    incremental=False,
+    workers=1,
+    critical_css=False,
+    compression="best",
+    verify_blocks=False,
+    in_place=False,
+    changed_paths=None,
+):
+    """
+    Build the site into published/ and return the manifest and the removed outputs.
 
-    # Copy static files
-    copy_files(publish_dir, src_dir)
+    Safe to call repeatedly from a long-running process: templates, the Markdown
+    converter and file hashes stay warm between calls. in_place incremental builds
+    write straight into the live build instead of a staged copy (see StagedPublish).
+    changed_paths, the source files changed since the previous call, lets such a
+    build skip scanning the static files and images when none of them changed.
+    """
+    global _asset_outputs, _shared_state
+
+    # Filters are set up again below from this build's assets and images
+    OUTPUT_FILTERS.clear()
+
+    # Render into a staging directory that replaces published/ only once it's complete.
+    # Incremental builds start from hard links to the live build; others from nothing.
+    staged = StagedPublish(PUBLISH_DIR)
+    with PROFILER.stage("stage output"):
+        publish_dir, src_dir = set_up_directories(staged.stage(incremental, in_place))
+
+    ROUTES.reset(publish_dir)
+
+    try:
+        # The manifest is always written so the next incremental build has something to compare to
+        manifest = Manifest(publish_dir, fresh=not incremental)
+
+        if (
+            staged.in_place
+            and changed_paths is not None
+            and _asset_outputs is not None
+            and _asset_outputs[0].publish_dir == publish_dir
+            and not touches_assets(changed_paths)
+        ):
+            # Nothing the asset stages read changed, so their outputs and state are as they were
+            responsive_images, keys = _asset_outputs
+            manifest.carry(keys)
+        else:
+            # Copy static files
+            with build_stage("copy static", manifest):
+                copy_files(publish_dir, src_dir, manifest)
+
+            # Write content-addressed copies of static assets for templates to link to
+            with build_stage("fingerprint assets", manifest):
+                ASSETS.build(src_dir / "static", publish_dir / "static", manifest)
+
+            # Generate resized WebP/AVIF variants and serve them from <picture> elements
+            with build_stage("responsive images", manifest):
+                responsive_images = ResponsiveImages(publish_dir)
+                responsive_images.build(src_dir, manifest)
+            # The asset stages come first, so everything recorded so far is theirs
+            _asset_outputs = (responsive_images, list(manifest.current))
+        OUTPUT_FILTERS.append(responsive_images)
+
+        if critical_css:
+            OUTPUT_FILTERS.append(CriticalCSS(ASSETS, publish_dir / "static"))
+
+        # Minify last so it sees the final markup
+        OUTPUT_FILTERS.append(MarkupMinifier())
+        _shared_state = None
+
+        # Generate blog posts
+        with open(src_dir / "blog_metadata.json", "r") as f:
+            blog_posts = json.load(f)
+
+        get_block_renderer().verify = verify_blocks
+        with build_stage("render posts", manifest):
+            render_posts(
+                blog_posts,
+                src_dir / "blog/md",
+                publish_dir / "blog",
+                manifest=manifest,
+                workers=workers,
+            )
+        # Keep the formula cache bounded; workers only ever add to it
+        evict_mathml_cache()
+        # Forget the blocks of deleted posts
+        get_block_renderer().prune(src_dir / "blog/md" / (post["id"] + ".md") for post in blog_posts)
+
+        # Index what the posts say so the blog can be searched without a server
+        with build_stage("search index", manifest):
+            SEARCH.update(
+                publish_dir,
+                search_documents(blog_posts, src_dir / "blog/md", publish_dir / "blog", manifest),
+                manifest,
+            )
+
+        # Generate other pages
+        with build_stage("render pages", manifest):
+            for generate, *generator_args in (
+                (generate_home, publish_dir),
+                (generate_blog_index, blog_posts, publish_dir, src_dir),
+                (generate_feeds, blog_posts, publish_dir),
+                (generate_contact, publish_dir),
+                (generate_tools, publish_dir),
+                (generate_data, publish_dir, src_dir),
+                (generate_tool_pages, publish_dir),
+                (generate_logo_page, publish_dir),
+            ):
+                with PROFILER.item("render pages", generate.__name__):
+                    generate(*generator_args, manifest)
+
+        with build_stage("sitemap", manifest):
+            generate_sitemap(publish_dir, manifest)
+
+        # Write .br/.gz siblings of every text file for servers that serve them directly
+        with build_stage("precompress", manifest):
+            precompress(publish_dir, manifest, level=compression)
+
+        # Remove outputs whose sources disappeared
+        with PROFILER.stage("prune"):
+            removed = manifest.prune()
+    except BaseException:
+        # A staged build leaves the live one untouched; just drop the partial one
+        staged.abort()
+        _asset_outputs = None
+        raise
+
+    with PROFILER.stage("publish"):
+        staged.commit()
+        manifest.save()
+        SEARCH.save()
+
+    return manifest, removed
 
-    # Generate blog posts
-    with open(src_dir / "blog_metadata.json", "r") as f:
-        blog_posts = json.load(f)
 
-    for post in blog_posts:
-        convert_markdown_to_html(
-            Path("src/blog/md") / (post["id"] + ".md"),
-            metadata=post,
-            output_dir=publish_dir / "blog",
+if __name__ == "__main__":
+    args = parse_args()
+    with profiled(args):
+        manifest, removed = build(
+            args.incremental, args.workers, args.critical_css, verify_blocks=args.verify_blocks
         )
 
-    # Generate other pages
-    generate_home(publish_dir)
-    generate_blog_index(blog_posts, publish_dir, src_dir)
-    generate_rss_feed(blog_posts, publish_dir)
-    generate_contact(publish_dir)
-    generate_tools(publish_dir)
-    generate_data(publish_dir, src_dir)
-    generate_tool_pages(publish_dir)
-    generate_logo_page(publish_dir)
-    generate_sitemap(publish_dir, src_dir, blog_posts)
+    if args.incremental:
+        print(f"Rebuilt {len(manifest.rebuilt)} outputs, removed {len(removed)}")
+
+    bytecode_cache = setup_jinja().bytecode_cache
+    print(f"Template cache: {bytecode_cache.hits} hits, {bytecode_cache.misses} misses")
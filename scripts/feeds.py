@@ -0,0 +1,92 @@
+import datetime
+import email.utils
+from sitemap import SITE_URL
+
+# Most recently edited posts in the subscription feeds
+FEED_SIZE = 20
+
+# Posts per archive document; only full pages are archived, so archives never change
+# unless a post in them is edited or deleted. Posts not yet archived always go in
+# the subscription feed, so a page can hold at most FEED_SIZE + 1 of them
+ARCHIVE_PAGE_SIZE = 20
+assert ARCHIVE_PAGE_SIZE <= FEED_SIZE + 1
+
+FEED_TITLE = "vtasca.dev - Blog"
+FEED_DESCRIPTION = "Hot takes, sorted chronologically"
+BLOG_URL = f"{SITE_URL}/blog"
+
+
+def rfc822(timestamp):
+    """2025-06-10T21:56:00.000Z -> Tue, 10 Jun 2025 21:56:00 GMT, as RSS dates are written"""
+    if not timestamp:
+        return ""
+    parsed = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return email.utils.format_datetime(parsed.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def by_last_edit(posts):
+    return sorted(posts, key=lambda post: (post.get("last_edited_time", ""), post["id"]), reverse=True)
+
+
+def partition_posts(blog_posts, feed_size=FEED_SIZE, page_size=ARCHIVE_PAGE_SIZE):
+    """
+    Split posts into the subscription feed and RFC 5005 archive pages.
+
+    Archives are filled in order of creation, oldest page first, so new posts never
+    move older ones between pages. The subscription feed holds at most feed_size
+    posts: every post not yet on a full page, so the two together cover every
+    post, then the most recently edited of the rest.
+    """
+    by_creation = sorted(blog_posts, key=lambda post: (post.get("created_time", ""), post["id"]))
+    archived = len(by_creation) // page_size * page_size
+    pages = [
+        list(reversed(by_creation[start:start + page_size]))
+        for start in range(0, archived, page_size)
+    ]
+
+    current = {post["id"]: post for post in by_creation[archived:]}
+    for post in by_last_edit(blog_posts):
+        if len(current) >= feed_size:
+            break
+        current.setdefault(post["id"], post)
+    return by_last_edit(current.values()), pages
+
+
+def newest_edit(posts):
+    """The latest last_edited_time of any post, or None without posts"""
+    return max((post["last_edited_time"] for post in posts if post.get("last_edited_time")), default=None)
+
+
+def archive_path(number, suffix):
+    return f"blog/archive/{number}{suffix}"
+
+
+def json_feed(posts, feed_url, next_url=None):
+    """A JSON Feed 1.1 document for posts"""
+    feed = {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": FEED_TITLE,
+        "home_page_url": BLOG_URL,
+        "feed_url": feed_url,
+        "description": FEED_DESCRIPTION,
+        "favicon": f"{SITE_URL}/favicon.ico",
+        "language": "en-US",
+        "items": [
+            {
+                "id": f"{BLOG_URL}/{post['url']}",
+                "url": f"{BLOG_URL}/{post['url']}",
+                "title": post.get("name", ""),
+                "summary": post.get("description", ""),
+                # Every item needs content; pages are rendered with relative links that
+                # wouldn't resolve in a reader, so the description stands in for the body
+                "content_text": post.get("description") or post.get("name", ""),
+                "date_published": post.get("created_time"),
+                "date_modified": post.get("last_edited_time"),
+                "tags": post.get("tags", []),
+            }
+            for post in posts
+        ],
+    }
+    if next_url:
+        feed["next_url"] = next_url
+    return feed
@@ -1,14 +1,24 @@
 from notion_client import Client
-from notion2md.exporter.block import MarkdownExporter
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+from notion2md.config import Config
+from notion2md.convertor.block import BlockConvertor
 import os
 from pathlib import Path
+import argparse
+import asyncio
+import hashlib
 import json
+import random
 import shutil
-import zipfile
+import time
 import re
 import unicodedata
+from urllib.parse import unquote, urlparse
+import httpx
 import requests
-from process_svg import process_svg
+from requests.adapters import HTTPAdapter
+from process_svg import theme_svgs, THEME_VARIANTS
+from profiler import PROFILER, add_profile_arguments, profiled
 
 from dotenv import load_dotenv
 
@@ -16,26 +26,168 @@ load_dotenv()
 
 NOTION_TOKEN = os.environ["NOTION_TOKEN"]
 DATABASE_ID = os.environ["NOTION_DATABASE_ID"]
+# Point this at a local stub server to exercise the fetch without hitting Notion
+NOTION_BASE_URL = os.environ.get("NOTION_BASE_URL", "https://api.notion.com")
 
-def get_database_entries(database_id):
+# Retry settings for rate limited (429) and transient server errors
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Failures with no response at all: timeouts and dropped or refused connections
+TRANSIENT_ERRORS = (RequestTimeoutError, httpx.TransportError, requests.ConnectionError, requests.Timeout)
+
+# Seconds to wait for Notion, or between bytes of a download, before giving up on an attempt
+REQUEST_TIMEOUT = 30
+
+# Keep-alive connections held open per host
+DEFAULT_POOL_SIZE = 8
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class RetryableResponseError(Exception):
+    """A plain HTTP response (e.g. an image download) that asked us to retry"""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} for {response.url}")
+        self.status = response.status_code
+        self.headers = response.headers
+
+
+def retry_delay(attempt, headers=None):
+    """Seconds to wait before the next attempt, honouring Retry-After when present"""
+    retry_after = (headers or {}).get("retry-after")
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    # Exponential backoff with jitter so concurrent workers don't retry in lockstep
+    return min(RETRY_BASE_DELAY * 2**attempt, RETRY_MAX_DELAY) * random.uniform(0.5, 1)
+
+
+def with_retries(func, *args, **kwargs):
+    """
+    Call func, retrying with backoff when Notion or a download responds with 429
+    or 5xx, times out or loses its connection.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except (HTTPResponseError, RetryableResponseError) as e:
+            if e.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, e.headers)
+            reason = f"Got {e.status}"
+        except TRANSIENT_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt)
+            reason = f"{type(e).__name__}: {e}"
+        print(f"{reason}, retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})")
+        time.sleep(delay)
+
+
+class FetchContext:
+    """
+    Connections shared by every request made during a fetch.
+
+    Owns one keep-alive httpx pool behind the Notion client and one requests.Session
+    for file downloads, so posts reuse open TCP/TLS connections instead of opening
+    new ones per call. Pool sizes should be at least the export concurrency.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            )
+        )
+        self.notion = Client(
+            auth=NOTION_TOKEN,
+            base_url=NOTION_BASE_URL,
+            timeout_ms=REQUEST_TIMEOUT * 1000,
+            client=self.http,
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.http.close()
+        self.session.close()
+
+    def download(self, url, destination):
+        """
+        Stream a URL straight to destination and return whether it succeeded.
+
+        Raises RetryableResponseError for responses worth retrying, and requests'
+        ConnectionError or Timeout when the server stops answering. The body is
+        written to a sibling .part file first so a failed download never leaves
+        a truncated file behind.
+        """
+        with self.session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code in RETRY_STATUSES:
+                raise RetryableResponseError(response)
+            if response.status_code != 200:
+                return False
+
+            partial = destination.with_name(destination.name + ".part")
+            size = 0
+            with open(partial, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+            partial.replace(destination)
+            PROFILER.add("downloads", count=1, bytes=size)
+            return True
+
+    def get_children(self, parent_id):
+        """Fetch every child block of a block, the same way notion2md's NotionClient does"""
+        results = []
+        start_cursor = None
+        while True:
+            response = with_retries(
+                self.notion.blocks.children.list,
+                block_id=parent_id,
+                start_cursor=start_cursor,
+                page_size=100,
+            )
+            results.extend(response["results"])
+            if not response.get("has_more"):
+                return results
+            start_cursor = response["next_cursor"]
+
+
+def get_database_entries(database_id, context):
     """
     Fetch all pages from a Notion database
     Returns the full results list containing all page data
     """
     results = []
 
-    notion = Client(auth=NOTION_TOKEN)
+    notion = context.notion
 
     # Query the database
-    response = notion.databases.query(database_id=database_id)
+    response = with_retries(notion.databases.query, database_id=database_id)
 
     # Add the first set of results
     results.extend(response["results"])
 
     # Continue fetching if there are more results
     while response.get("has_more"):
-        response = notion.databases.query(
-            database_id=database_id, start_cursor=response["next_cursor"]
+        response = with_retries(
+            notion.databases.query,
+            database_id=database_id,
+            start_cursor=response["next_cursor"],
         )
         results.extend(response["results"])
 
@@ -97,14 +249,42 @@ def extract_blog_metadata(posts, output_dir='src', filename='blog_metadata.json'
 
     return blog_data
 
-def export_markdown(block_id, output_dir='src'):
+class StreamingBlockConvertor(BlockConvertor):
+    """
+    notion2md's block convertor, converting straight to a markdown string.
+
+    Instead of collecting files in a scratch directory for a zip, every image or
+    file block is streamed into img_dir through the shared session and linked as
+    img/<name>, the path the blog expects.
+    """
+
+    def __init__(self, block_id, context, img_dir):
+        super().__init__(Config(block_id=block_id, download=True), context)
+        self._context = context
+        self._img_dir = Path(img_dir)
+
+    def download_file(self, url):
+        file_name = unquote(os.path.basename(urlparse(url).path))
+        name, extension = os.path.splitext(file_name)
+        if not extension:
+            return file_name, url
+
+        # Same naming scheme as notion2md so existing image names stay stable
+        url_hash = hashlib.blake2s(urlparse(url).path.encode()).hexdigest()[:8]
+        downloaded_file_name = f"{url_hash}_{file_name}"
+        with_retries(self._context.download, url, self._img_dir / downloaded_file_name)
+
+        return name, f"img/{downloaded_file_name}"
+
+
+def export_markdown(block_id, context, output_dir='src'):
     # Only create directories if they don't exist - don't delete them
     Path(output_dir + "/blog/md").mkdir(exist_ok=True, parents=True)
     Path(output_dir + "/blog/img").mkdir(exist_ok=True, parents=True)
 
     # Get the post metadata to check for header image
-    notion = Client(auth=NOTION_TOKEN)
-    post = notion.pages.retrieve(page_id=block_id)
+    notion = context.notion
+    post = with_retries(notion.pages.retrieve, page_id=block_id)
     properties = post["properties"]
     
     # Get the image URL if it exists
@@ -113,64 +293,23 @@ def export_markdown(block_id, output_dir='src'):
     
     # Download header image if it exists
     if image_url:
-        image_response = requests.get(image_url)
-        if image_response.status_code == 200:
-            # Extract file extension from URL, default to .png if not found
-            image_ext = Path(image_url.split('?')[0]).suffix or '.png'
-            # Save the image with the post ID as filename
-            image_path = Path(output_dir + "/blog/img") / f"{block_id}{image_ext}"
-            with open(image_path, 'wb') as f:
-                f.write(image_response.content)
-            
-            # Process SVG files if the image is an SVG
-            if image_ext.lower() == '.svg':
-                process_svg(str(image_path), '#e0e0e0')
-
-                light_svg_path = image_path.with_suffix('.light.svg')
-                shutil.copy(image_path, light_svg_path)
-                process_svg(str(light_svg_path), '#2c2c2c')
-
-    MarkdownExporter(
-        block_id=block_id, output_path="markdown_zip_container", download=True
-    ).export()
+        # Extract file extension from URL, default to .png if not found
+        image_ext = Path(image_url.split('?')[0]).suffix or '.png'
+        # Save the image with the post ID as filename
+        image_path = Path(output_dir + "/blog/img") / f"{block_id}{image_ext}"
 
-    try:
-        # Find the zip file in the container directory
-        zip_path = list(Path("markdown_zip_container").glob("*.zip"))[0]
-
-        # Unzip the file
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall("temp_extract")
-
-        # Find the markdown file and images
-        markdown_path = list(Path("temp_extract").rglob("*.md"))[0]
-        image_files = (
-            list(Path("temp_extract").rglob("*.png"))
-            + list(Path("temp_extract").rglob("*.jpg"))
-            + list(Path("temp_extract").rglob("*.jpeg"))
-        )
+        # SVG headers are themed afterwards for every post at once, see theme_header_svgs
+        with_retries(context.download, image_url, image_path)
 
-        # Read and modify the markdown content
-        with open(markdown_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            # Update image paths to use ../img/
-            content = re.sub(r'!\[([^\]]*)\]\(([^)]+)\)', 
-                           lambda m: f'![{m.group(1)}](img/{Path(m.group(2)).name})', 
-                           content)
+    try:
+        # Convert the blocks in memory; images land directly in src/blog/img
+        convertor = StreamingBlockConvertor(block_id, context, output_dir + "/blog/img")
+        content = convertor.to_string(context.get_children(block_id))
 
-        # Move the markdown file to md directory with updated content
-        md_destination = Path(output_dir + "/blog/md") / markdown_path.name
+        md_destination = Path(output_dir + "/blog/md") / f"{block_id}.md"
         with open(md_destination, 'w', encoding='utf-8') as f:
             f.write(content)
 
-        # Move all images to published/img directory
-        for img_path in image_files:
-            shutil.move(str(img_path), Path(output_dir + "/blog/img") / img_path.name)
-
-        # Clean up
-        shutil.rmtree("markdown_zip_container")
-        shutil.rmtree("temp_extract")
-
     except PermissionError:
         print(
             "Could not access the files. Please ensure they're not open in another program."
@@ -178,22 +317,159 @@ def export_markdown(block_id, output_dir='src'):
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
-if __name__ == "__main__":
-    # Get all blog posts
-    all_blog_posts = get_database_entries(DATABASE_ID)
 
-    extract_blog_metadata(all_blog_posts, output_dir="src", filename="blog_metadata.json")
+def theme_header_svgs(block_ids, output_dir='src'):
+    """Write the dark and light variants of every downloaded SVG header image in parallel"""
+    svg_files = [
+        path for path in (Path(output_dir + "/blog/img") / f"{block_id}.svg" for block_id in block_ids)
+        if path.exists()
+    ]
+    theme_svgs(svg_files, THEME_VARIANTS)
 
-    # Clean directories once before processing all posts
-    if Path("src/blog/md").exists():
-        shutil.rmtree("src/blog/md", ignore_errors=True)
-    if Path("src/blog/img").exists():
-        shutil.rmtree("src/blog/img", ignore_errors=True)
-    
 
-    # Load blog metadata from JSON file
-    with open("src/blog_metadata.json", "r") as f:
-        blog_posts = json.load(f)
+def load_blog_metadata(output_dir='src', filename='blog_metadata.json'):
+    """Load the metadata written by the previous fetch, or an empty list on the first run"""
+    path = Path(output_dir) / filename
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def plan_delta_sync(previous_posts, current_posts, output_dir='src'):
+    """
+    Compare two metadata snapshots and return (posts to export, ids to prune).
+
+    A post is exported when it is new, its last_edited_time moved or its markdown
+    is missing locally. Posts that disappeared (deleted or unpublished) are pruned.
+    """
+    previous = {post["id"]: post for post in previous_posts}
+    current_ids = {post["id"] for post in current_posts}
+
+    to_export = []
+    for post in current_posts:
+        old = previous.get(post["id"])
+        md_path = Path(output_dir + "/blog/md") / f"{post['id']}.md"
+        if (
+            old is None
+            or old.get("last_edited_time") != post.get("last_edited_time")
+            or not md_path.exists()
+        ):
+            to_export.append(post)
+
+    to_prune = [post_id for post_id in previous if post_id not in current_ids]
+    return to_export, to_prune
+
+
+def remove_post_files(post_id, output_dir='src'):
+    """Delete a post's markdown and header images"""
+    md_path = Path(output_dir + "/blog/md") / f"{post_id}.md"
+    if md_path.exists():
+        md_path.unlink()
+    for image_path in Path(output_dir + "/blog/img").glob(f"{post_id}.*"):
+        image_path.unlink()
+
+
+def prune_orphaned_images(blog_posts, output_dir='src'):
+    """Delete inline images that no remaining markdown file links to"""
+    img_dir = Path(output_dir + "/blog/img")
+    if not img_dir.exists():
+        return []
+
+    referenced = set()
+    for md_path in Path(output_dir + "/blog/md").glob("*.md"):
+        with open(md_path, "r", encoding="utf-8") as f:
+            referenced.update(re.findall(r'\]\(img/([^)]+)\)', f.read()))
+
+    # Header images are named after their post rather than linked from the markdown
+    post_ids = {post["id"] for post in blog_posts}
+
+    removed = []
+    for image_path in img_dir.iterdir():
+        if image_path.name in referenced or image_path.name.split(".")[0] in post_ids:
+            continue
+        image_path.unlink()
+        removed.append(image_path.name)
+    return removed
+
+
+async def export_all(block_ids, context, concurrency=4, output_dir='src'):
+    """
+    Export several posts at once, with at most `concurrency` exports in flight.
+
+    Exports are mostly spent waiting on Notion and image downloads, so each one
+    runs in a worker thread while the event loop bounds how many run together.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def export_timed(block_id):
+        with PROFILER.item("export posts", block_id):
+            export_markdown(block_id, context, output_dir)
 
-    for post in blog_posts:
-        export_markdown(post["id"])
\ No newline at end of file
+    async def export_one(block_id):
+        async with semaphore:
+            await asyncio.to_thread(export_timed, block_id)
+
+    await asyncio.gather(*(export_one(block_id) for block_id in block_ids))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch published blog posts from Notion")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of posts exported at the same time",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only export posts that are new or whose last_edited_time changed, and prune removed ones",
+    )
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    concurrency = max(1, args.concurrency)
+
+    # Snapshot the previous run before extract_blog_metadata overwrites it
+    previous_posts = load_blog_metadata() if args.delta else []
+
+    # Size the connection pools so every concurrent export can keep a connection open
+    with profiled(args), FetchContext(pool_size=max(DEFAULT_POOL_SIZE, concurrency)) as context:
+        # Get all blog posts
+        with PROFILER.stage("query database"):
+            all_blog_posts = get_database_entries(DATABASE_ID, context)
+
+        blog_posts = extract_blog_metadata(all_blog_posts, output_dir="src", filename="blog_metadata.json")
+
+        if args.delta:
+            to_export, to_prune = plan_delta_sync(previous_posts, blog_posts)
+            print(f"Delta sync: {len(to_export)} to export, {len(to_prune)} to prune, "
+                  f"{len(blog_posts) - len(to_export)} unchanged")
+
+            # Changed posts drop their old header images in case the file type changed
+            for post_id in to_prune + [post["id"] for post in to_export]:
+                remove_post_files(post_id)
+
+            with PROFILER.stage("export posts"):
+                asyncio.run(export_all([post["id"] for post in to_export], context, concurrency))
+            with PROFILER.stage("theme svgs"):
+                theme_header_svgs([post["id"] for post in to_export])
+
+            # Edits can drop inline images just like deleted posts do
+            with PROFILER.stage("prune images"):
+                prune_orphaned_images(blog_posts)
+        else:
+            # Clean directories once before processing all posts
+            if Path("src/blog/md").exists():
+                shutil.rmtree("src/blog/md", ignore_errors=True)
+            if Path("src/blog/img").exists():
+                shutil.rmtree("src/blog/img", ignore_errors=True)
+
+            with PROFILER.stage("export posts"):
+                asyncio.run(export_all([post["id"] for post in blog_posts], context, concurrency))
+            with PROFILER.stage("theme svgs"):
+                theme_header_svgs([post["id"] for post in blog_posts])
@@ -0,0 +1,93 @@
+from pathlib import Path
+import argparse
+import os
+from markdown2 import Markdown
+from markupsafe import Markup
+import pygments
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+from manifest import hash_bytes
+
+HIGHLIGHT_CACHE_DIR = Path(".cache/highlight")
+
+# Pygments colour scheme, same palette the site used to load from highlight.js
+HIGHLIGHT_STYLE = "github-dark"
+
+# Class on the <div> markdown2 wraps highlighted blocks in
+CSS_CLASS = "codehilite"
+
+STYLESHEET_PATH = Path("src/static/styles/highlight.css")
+
+
+class CodeFormatter(HtmlFormatter):
+    """<div class="codehilite"><pre><code>...</code></pre></div>, as markdown2 emits it"""
+
+    def wrap(self, source):
+        yield 0, "\n"
+        yield 0, "<pre><code>"
+        yield from source
+        yield 0, "</code></pre>"
+        yield 0, "\n"
+
+
+def highlight(code, lexer):
+    """
+    Highlight code with a pygments lexer (or the name of one), caching the markup.
+
+    Highlighted blocks are cached in .cache/highlight keyed by the language and a
+    hash of the code, so a block is only ever tokenised once across builds.
+    """
+    if isinstance(lexer, str):
+        lexer = get_lexer_by_name(lexer)
+
+    key = hash_bytes(pygments.__version__, CSS_CLASS, lexer.name, code)
+    cached = HIGHLIGHT_CACHE_DIR / f"{key[:32]}.html"
+    if cached.exists():
+        return cached.read_text(encoding="utf-8")
+
+    highlighted = pygments.highlight(code, lexer, CodeFormatter(cssclass=CSS_CLASS))
+    # Posts render in parallel, so write under a unique name and move into place
+    HIGHLIGHT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    partial = cached.with_name(f"{cached.name}.{os.getpid()}.part")
+    partial.write_text(highlighted, encoding="utf-8")
+    partial.replace(cached)
+    return highlighted
+
+
+def highlight_filter(code, language):
+    """Jinja filter for code written directly in templates: {{ code | highlight('bash') }}"""
+    try:
+        return Markup(highlight(str(code), language))
+    except ClassNotFound:
+        return Markup("<pre><code>{}</code></pre>").format(code)
+
+
+class HighlightingMarkdown(Markdown):
+    """Markdown whose fenced code blocks are highlighted through the cache"""
+
+    def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
+        return highlight(codeblock, lexer)
+
+
+def stylesheet():
+    """Token colours for highlighted blocks"""
+    rules = HtmlFormatter(style=HIGHLIGHT_STYLE).get_style_defs(f".{CSS_CLASS}")
+    # Leave out the global pre/line number rules pygments adds
+    return "\n".join(
+        line for line in rules.splitlines() if line.startswith(f".{CSS_CLASS}")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate the syntax highlighting stylesheet")
+    parser.add_argument("output", nargs="?", type=Path, default=STYLESHEET_PATH)
+    args = parser.parse_args()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(f"/* Generated by scripts/highlight.py from the pygments {HIGHLIGHT_STYLE} style */\n")
+        f.write(stylesheet() + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import html
+import posixpath
+import re
+import shutil
+from PIL import Image, features
+from manifest import hash_bytes, hash_file
+from publish import prepare_output
+
+IMAGE_CACHE_DIR = Path(".cache/images")
+
+# Only raster images are resized; SVGs, icons and GIFs are shipped as they are
+RASTER_SUFFIXES = {".png", ".jpg", ".jpeg"}
+
+# Target widths; images narrower than the smallest one are left alone
+VARIANT_WIDTHS = (480, 960, 1600)
+
+# Modern encodings in order of preference, AVIF only when Pillow was built with it
+ENCODINGS = {"avif": {"quality": 55}, "webp": {"quality": 80}}
+if not features.check("avif"):
+    del ENCODINGS["avif"]
+
+# Content column is at most 800px wide (see base.css)
+SIZES = "(max-width: 800px) 100vw, 800px"
+
+# Bump to re-encode every cached variant, e.g. after changing the quality settings
+ENCODER_VERSION = 1
+
+# Content digest -> (width, height), so repeated builds in one process don't reopen images
+_image_sizes = {}
+
+IMG_TAG_PATTERN = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)="([^"]*)"')
+
+
+def variant_widths(width):
+    """Widths to generate for an image that is `width` pixels wide"""
+    if width < VARIANT_WIDTHS[0]:
+        return []
+    return sorted({min(target, width) for target in VARIANT_WIDTHS})
+
+
+def encode_variant(source_path, digest, width, encoding):
+    """Resize and re-encode one variant into the cache, unless it's already there"""
+    cached = IMAGE_CACHE_DIR / f"{digest[:20]}-{width}.{encoding}"
+    if cached.exists():
+        return cached
+
+    with Image.open(source_path) as image:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        if image.width != width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+
+        partial = cached.with_name(cached.name + ".part")
+        image.save(partial, format=encoding.upper(), **ENCODINGS[encoding])
+    partial.replace(cached)
+    return cached
+
+
+class ResponsiveImages:
+    """
+    Width variants and modern encodings of every raster image in the site.
+
+    build() encodes the variants into a cache keyed by each image's content hash,
+    so an image is only ever encoded once, and copies them next to the original in
+    the publish directory. The instance is then used as an output filter that
+    rewrites <img> tags pointing at those images into <picture> elements.
+    """
+
+    def __init__(self, publish_dir):
+        self.publish_dir = Path(publish_dir)
+        # URL path relative to the site root -> {"width", "height", "variants"}
+        self.images = {}
+
+    @property
+    def digest(self):
+        return hash_bytes(ENCODER_VERSION, SIZES, self.images)
+
+    def build(self, src_dir, manifest=None, workers=None):
+        """Generate variants for src/static and src/blog/img"""
+        IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+        sources = []
+        for source_dir, url_prefix in ((src_dir / "static", "static"), (src_dir / "blog/img", "blog/img")):
+            if not source_dir.exists():
+                continue
+            for source in sorted(source_dir.rglob("*")):
+                if source.suffix.lower() in RASTER_SUFFIXES:
+                    sources.append((source, f"{url_prefix}/{source.relative_to(source_dir).as_posix()}"))
+
+        jobs = []
+        for source, url_path in sources:
+            digest = hash_bytes(ENCODER_VERSION, hash_file(source))
+            if digest not in _image_sizes:
+                with Image.open(source) as image:
+                    _image_sizes[digest] = image.size
+            width, height = _image_sizes[digest]
+
+            variants = {}
+            for encoding in ENCODINGS:
+                variants[encoding] = []
+                for variant_width in variant_widths(width):
+                    # Content-addressed like the other static assets, so they can be cached forever
+                    name = f"{Path(url_path).stem}.{digest[:8]}-{variant_width}w.{encoding}"
+                    variants[encoding].append((variant_width, name))
+                    jobs.append((source, digest, variant_width, encoding, Path(url_path).parent / name))
+
+            if variant_widths(width):
+                self.images[url_path] = {"width": width, "height": height, "variants": variants}
+
+        # Encoders release the GIL, so threads are enough to use every core
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            cached_paths = list(
+                pool.map(lambda job: encode_variant(*job[:4]), jobs)
+            )
+
+        for (_, digest, variant_width, encoding, target), cached in zip(jobs, cached_paths):
+            target = self.publish_dir / target
+            if manifest is None or manifest.needs_update(target, hash_bytes(digest, variant_width, encoding)):
+                prepare_output(target)
+                shutil.copy2(cached, target)
+
+    def resolve(self, output_path, src):
+        """Map an <img> src on the page at output_path to a URL path relative to the site root"""
+        if src.startswith(("http://", "https://", "//", "data:")):
+            return None
+        src = src.split("?")[0].split("#")[0]
+        if src.startswith("/"):
+            return src.lstrip("/")
+        page_dir = Path(output_path).parent.relative_to(self.publish_dir).as_posix()
+        return posixpath.normpath(posixpath.join(page_dir, src))
+
+    def __call__(self, output_path, content):
+        if not self.images or not str(output_path).endswith(".html"):
+            return content
+
+        # The first image on a page is likely the largest paint, so only lazy load the rest
+        seen_images = 0
+
+        def replace(match):
+            nonlocal seen_images
+            tag = match.group(0)
+            attributes = dict(ATTRIBUTE_PATTERN.findall(tag))
+            if "srcset" in attributes or "src" not in attributes:
+                return tag
+            image = self.images.get(self.resolve(output_path, html.unescape(attributes["src"])))
+            if image is None:
+                return tag
+
+            src_dir = posixpath.dirname(attributes["src"])
+            sources = []
+            for encoding, variants in image["variants"].items():
+                srcset = ", ".join(
+                    f"{posixpath.join(src_dir, name)} {width}w" for width, name in variants
+                )
+                sources.append(
+                    f'<source type="image/{encoding}" srcset="{srcset}" sizes="{SIZES}">'
+                )
+
+            # Explicit dimensions let the browser reserve space before the image loads
+            extra = ""
+            if "width" not in attributes and "height" not in attributes:
+                extra += f' width="{image["width"]}" height="{image["height"]}"'
+            extra += ' decoding="async"'
+            if seen_images and "loading" not in attributes:
+                extra += ' loading="lazy"'
+            seen_images += 1
+            img = re.sub(r"\s*/?>$", extra + ">", tag)
+
+            return f"<picture>{''.join(sources)}{img}</picture>"
+
+        return IMG_TAG_PATTERN.sub(replace, content)
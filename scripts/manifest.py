@@ -0,0 +1,182 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import time
+
+MANIFEST_PATH = Path(".cache/build-manifest.json")
+TEMPLATE_DIR = Path("src/templates")
+
+# {% extends "base.html" %}, {% include "x.html" %}, {% import "x.html" as y %}, {% from "x.html" import y %}
+TEMPLATE_DEPENDENCY_PATTERN = re.compile(
+    r"""{%-?\s*(?:extends|include|import|from)\s+["']([^"']+)["']"""
+)
+
+
+def hash_bytes(*parts):
+    """Hash any number of str/bytes/JSON-serialisable parts into one hex digest"""
+    digest = hashlib.sha256()
+    for part in parts:
+        update_digest(digest, part)
+    return digest.hexdigest()
+
+
+def update_digest(digest, part):
+    """Add one part to a hashlib digest the way hash_bytes does, for parts produced one at a time"""
+    if isinstance(part, str):
+        part = part.encode("utf-8")
+    elif not isinstance(part, bytes):
+        part = json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+    digest.update(len(part).to_bytes(8, "little"))
+    digest.update(part)
+
+
+# (device, inode) -> (mtime_ns, size, digest), so long-running processes only rehash
+# files that changed. Keyed by inode so hard links to the same file share an entry.
+_file_hashes = {}
+
+
+def hash_file(path):
+    """Hash the contents of a file, or return None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    cached = _file_hashes.get((stat.st_dev, stat.st_ino))
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    _file_hashes[(stat.st_dev, stat.st_ino)] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def evict_least_recent(cache_dir, max_bytes, interval, force=False):
+    """
+    Delete the least recently used files of a cache sharded into subdirectories until
+    it fits in max_bytes. Caches mark a hit by touching the file.
+
+    Scanning a large cache isn't free, so unless forced this runs at most once per
+    interval seconds, tracked by a .evicted stamp in cache_dir.
+    """
+    cache_dir = Path(cache_dir)
+    stamp = cache_dir / ".evicted"
+    if not cache_dir.exists():
+        return 0
+    if not force and stamp.exists() and time.time() - stamp.stat().st_mtime < interval:
+        return 0
+    stamp.touch()
+
+    entries = []
+    for shard in os.scandir(cache_dir):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.unlink(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def build_salt():
+    """Hash of the build scripts themselves, so code changes invalidate every output"""
+    scripts_dir = Path(__file__).parent
+    return hash_bytes(
+        *[hash_file(path) for path in sorted(scripts_dir.glob("*.py"))]
+    )
+
+
+class Manifest:
+    """
+    Persistent record of the input hashes behind every file in the publish directory.
+
+    Each output is keyed by its path relative to the publish directory. An output is
+    only rebuilt when the digest of its inputs differs from the previous build, and
+    outputs that weren't produced by the current build are pruned at the end.
+    """
+
+    def __init__(self, publish_dir, path=MANIFEST_PATH, fresh=False):
+        self.publish_dir = Path(publish_dir)
+        self.path = Path(path)
+        self.salt = build_salt()
+        self.previous = {}
+        self.current = {}
+        self.rebuilt = []
+        self._template_hashes = {}
+
+        if not fresh and self.path.exists():
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+            self.previous = saved.get("outputs", {})
+            # A change to the build scripts invalidates everything, but the
+            # outputs are still remembered so stale ones can be pruned
+            if saved.get("salt") != self.salt:
+                self.previous = dict.fromkeys(self.previous)
+
+    def template_hash(self, name, template_dir=TEMPLATE_DIR):
+        """Hash a template together with everything it extends, includes or imports"""
+        if name not in self._template_hashes:
+            # Guard against include cycles
+            self._template_hashes[name] = None
+            with open(Path(template_dir) / name, "r", encoding="utf-8") as f:
+                source = f.read()
+            dependencies = sorted(set(TEMPLATE_DEPENDENCY_PATTERN.findall(source)))
+            self._template_hashes[name] = hash_bytes(
+                source,
+                *[self.template_hash(dep, template_dir) or dep for dep in dependencies],
+            )
+        return self._template_hashes[name]
+
+    def key(self, output_path):
+        # Plain string slicing; Path.relative_to is slow enough to show up in warm rebuilds
+        path = os.fspath(output_path)
+        prefix = os.fspath(self.publish_dir) + os.sep
+        if path.startswith(prefix):
+            return path[len(prefix):].replace(os.sep, "/")
+        return Path(output_path).relative_to(self.publish_dir).as_posix()
+
+    def needs_update(self, output_path, digest):
+        """Record the digest for output_path and return whether it has to be (re)written"""
+        key = self.key(output_path)
+        self.current[key] = digest
+        stale = self.previous.get(key) != digest or not Path(output_path).exists()
+        if stale:
+            self.rebuilt.append(key)
+        return stale
+
+    def carry(self, keys):
+        """Keep outputs from the previous build as they are, without checking them again"""
+        for key in keys:
+            self.current[key] = self.previous.get(key)
+
+    def prune(self):
+        """Delete outputs from the previous build whose sources have disappeared"""
+        removed = []
+        for key in sorted(set(self.previous) - set(self.current)):
+            output_path = self.publish_dir / key
+            if output_path.exists():
+                output_path.unlink()
+                removed.append(key)
+
+            # Tidy up directories left empty by the removal
+            parent = output_path.parent
+            while parent != self.publish_dir and parent.exists() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+        return removed
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"salt": self.salt, "outputs": self.current}, f, indent=2, sort_keys=True)
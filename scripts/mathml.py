@@ -0,0 +1,91 @@
+from pathlib import Path
+from functools import lru_cache
+import os
+import importlib.metadata
+from latex2mathml.converter import convert
+from markdown2 import Latex, Markdown
+from manifest import evict_least_recent, hash_bytes
+
+MATHML_CACHE_DIR = Path(".cache/mathml")
+
+# Bump to reconvert every formula after changing how formulas are wrapped
+MATHML_CACHE_VERSION = 1
+CONVERTER_VERSION = importlib.metadata.version("latex2mathml")
+
+# Least recently used formulas are evicted once the cache grows past this
+MATHML_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Scanning a large cache isn't free, so evict at most this often
+EVICTION_INTERVAL = 3600
+
+# Formulas kept in memory per process; posts reuse the same few expressions a lot
+MEMORY_ENTRIES = 4096
+
+# Block formulas are centred and scroll horizontally on their own (see article.css)
+BLOCK_TEMPLATE = '<div class="math-container">{}</div>'
+
+
+def cache_path(latex, display):
+    key = hash_bytes(MATHML_CACHE_VERSION, CONVERTER_VERSION, display, latex)
+    return MATHML_CACHE_DIR / key[:2] / f"{key[2:32]}.html"
+
+
+@lru_cache(maxsize=MEMORY_ENTRIES)
+def to_mathml(latex, display="inline"):
+    """
+    Convert a LaTeX formula to MathML, wrapped in a math-container when it's a block.
+
+    Conversions are cached on disk in .cache/mathml keyed by the formula and the
+    latex2mathml version. A hit refreshes the entry's mtime, which evict() uses to
+    find the least recently used ones.
+    """
+    path = cache_path(latex, display)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            mathml = f.read()
+        os.utime(path)
+        return mathml
+    except FileNotFoundError:
+        pass
+
+    mathml = convert(latex, display=display)
+    if display == "block":
+        mathml = BLOCK_TEMPLATE.format(mathml)
+
+    # Posts render in parallel, so write under a unique name and move into place
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f"{path.name}.{os.getpid()}.part")
+    partial.write_text(mathml, encoding="utf-8")
+    partial.replace(path)
+    return mathml
+
+
+def evict(max_bytes=MATHML_CACHE_MAX_BYTES, force=False):
+    """Delete the least recently used formulas until the cache fits in max_bytes"""
+    return evict_least_recent(MATHML_CACHE_DIR, max_bytes, EVICTION_INTERVAL, force)
+
+
+class CachedLatex(Latex):
+    """markdown2's latex extra, converting through the MathML cache"""
+
+    def run(self, text):
+        # markdown2 keeps code_blocks on the class, so it would otherwise grow with
+        # every document a long-lived Markdown instance converts
+        self.code_blocks = {}
+        return super().run(text)
+
+    def _convert_single_match(self, match):
+        return to_mathml(match.group(1))
+
+    def _convert_double_match(self, match):
+        return to_mathml(match.group(1).replace(r"\n", ""), display="block")
+
+
+class MathMLMarkdown(Markdown):
+    """Markdown whose latex extra goes through the MathML cache"""
+
+    def reset(self):
+        super().reset()
+        # Extras are instantiated again for every document
+        if "latex" in self.extra_classes:
+            self.extra_classes["latex"] = CachedLatex(self, self.extras.get("latex") or {})
@@ -0,0 +1,95 @@
+import re
+from manifest import hash_bytes
+
+# Bump to rebuild every page after changing what the minifiers do
+MINIFIER_VERSION = 1
+
+# Elements whose contents are whitespace sensitive or not markup at all
+HTML_RAW_PATTERN = re.compile(
+    r"(<(pre|textarea|script|style)\b[^>]*>)(.*?)(</\2\s*>)", re.IGNORECASE | re.DOTALL
+)
+XML_RAW_PATTERN = re.compile(
+    r"(<(text|textPath|tspan|style|script|title|desc)\b[^>]*>)(.*?)(</\2\s*>)|<!\[CDATA\[.*?\]\]>",
+    re.DOTALL,
+)
+
+# Comments, but not IE conditional comments
+HTML_COMMENT_PATTERN = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+XML_COMMENT_PATTERN = re.compile(r"<!--.*?-->", re.DOTALL)
+
+# Whitespace next to these tags never renders, so it can go entirely. Inline
+# elements (including <svg>, <math> and <picture>) keep a single space.
+BLOCK_TAGS = (
+    "html|head|body|title|meta|link|script|style|noscript|div|section|article|aside|header|"
+    "footer|nav|main|h[1-6]|p|ul|ol|li|dl|dt|dd|table|thead|tbody|tfoot|tr|th|td|form|"
+    "fieldset|blockquote|figure|figcaption|hr|br|pre|source|option|!doctype"
+)
+BLOCK_TAG_WHITESPACE_PATTERN = re.compile(
+    rf"""\s*(</?(?:{BLOCK_TAGS})\b(?:[^>"']|"[^"]*"|'[^']*')*>)\s*""",
+    re.IGNORECASE,
+)
+
+
+def _protect(pattern, content, transform=None):
+    """Swap matches of pattern for placeholders so the minifier leaves them alone"""
+    protected = []
+
+    def stash(match):
+        protected.append(transform(match) if transform else match.group(0))
+        return f"\x00{len(protected) - 1}\x00"
+
+    return pattern.sub(stash, content), protected
+
+
+def _restore(content, protected):
+    return re.sub(r"\x00(\d+)\x00", lambda match: protected[int(match.group(1))], content)
+
+
+def _squeeze_script(match):
+    """Drop indentation and blank lines from inline scripts, keeping line breaks for ASI"""
+    opening, _, body, closing = match.groups()
+    # Leading whitespace is significant inside template literals
+    if "`" not in body and opening.lower().startswith(("<script", "<style")):
+        body = "\n".join(line.strip() for line in body.splitlines() if line.strip())
+    return opening + body + closing
+
+
+def minify_html(content):
+    """Remove comments and whitespace that can't affect how a page renders"""
+    content, protected = _protect(HTML_RAW_PATTERN, content, _squeeze_script)
+    content = HTML_COMMENT_PATTERN.sub("", content)
+    content = re.sub(r"\s+", " ", content)
+    content = BLOCK_TAG_WHITESPACE_PATTERN.sub(r"\1", content)
+    return _restore(content.strip(), protected)
+
+
+def minify_xml(content):
+    """Remove comments and the whitespace between tags of XML and SVG documents"""
+    content, protected = _protect(XML_RAW_PATTERN, content)
+    content = XML_COMMENT_PATTERN.sub("", content)
+    # \x00 delimits a protected element, which is a tag boundary too
+    content = re.sub(r"([>\x00])\s+(?=[<\x00])", r"\1", content)
+    content = re.sub(r"\s+", " ", content)
+    return _restore(content.strip(), protected)
+
+
+MINIFIERS = {".html": minify_html, ".xml": minify_xml, ".svg": minify_xml}
+
+
+def minify(path, content):
+    """Minify content according to the suffix of path, leaving unknown types alone"""
+    for suffix, minifier in MINIFIERS.items():
+        if str(path).endswith(suffix):
+            return minifier(content)
+    return content
+
+
+class MarkupMinifier:
+    """Output filter that minifies rendered HTML and XML"""
+
+    @property
+    def digest(self):
+        return hash_bytes(MINIFIER_VERSION)
+
+    def __call__(self, output_path, content):
+        return minify(output_path, content)
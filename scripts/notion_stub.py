@@ -0,0 +1,162 @@
+"""
+A local stand-in for the Notion API and its file host that rate limits and fails
+like the real ones, to check that fetch.py retries instead of giving up.
+
+    python scripts/notion_stub.py            # run the checks against a stub
+    python scripts/notion_stub.py --serve    # just serve, for NOTION_BASE_URL
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+# Seconds the stub asks clients to wait in its Retry-After headers
+RETRY_AFTER = 1
+
+# path -> the failures served, in order, before it answers normally
+FAILURES = {
+    "/v1/databases/stub-database/query": [429, 429],
+    "/v1/pages/stub-page": [502],
+    "/v1/blocks/stub-page/children": ["hang"],
+    "/files/stub.png": [429, 503, "hang"],
+}
+
+PAGE = {"object": "page", "id": "stub-page", "properties": {}}
+RESPONSES = {
+    "/v1/databases/stub-database/query": {"object": "list", "results": [PAGE], "has_more": False, "next_cursor": None},
+    "/v1/pages/stub-page": PAGE,
+    "/v1/blocks/stub-page/children": {"object": "list", "results": [], "has_more": False, "next_cursor": None},
+}
+FILE_BODY = b"\x89PNG stub image"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Shared by every handler thread: how often each path has been requested
+    requests = Counter()
+    lock = threading.Lock()
+    # Seconds a "hang" failure stalls for, longer than the client's timeout
+    hang = 5
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond()
+
+    def respond(self):
+        path = self.path.split("?")[0]
+        with self.lock:
+            attempt = self.requests[path]
+            self.requests[path] += 1
+        failures = FAILURES.get(path, [])
+        if attempt < len(failures):
+            failure = failures[attempt]
+            if failure == "hang":
+                time.sleep(self.hang)
+                return
+            if failure == 429:
+                # Notion's rate limit error, which notion_client raises as an APIResponseError
+                body = json.dumps({"object": "error", "status": 429, "code": "rate_limited", "message": "Slow down"})
+                self.send(429, body.encode(), "application/json", {"Retry-After": str(RETRY_AFTER)})
+            else:
+                # A bare gateway error, which notion_client raises as an HTTPResponseError
+                self.send(failure, b"Bad gateway", "text/plain")
+            return
+
+        if path in RESPONSES:
+            self.send(200, json.dumps(RESPONSES[path]).encode(), "application/json")
+        elif path == "/files/stub.png":
+            self.send(200, FILE_BODY, "image/png")
+        else:
+            self.send(404, b"Not found", "text/plain")
+
+    def send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub(port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check(server):
+    """Fetch from the stub through fetch.py and return a list of failed checks"""
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    os.environ["NOTION_BASE_URL"] = base_url
+    os.environ.setdefault("NOTION_TOKEN", "stub-token")
+    os.environ.setdefault("NOTION_DATABASE_ID", "stub-database")
+    import fetch
+
+    # Hangs have to outlast the timeout for it to matter, so shorten both
+    fetch.REQUEST_TIMEOUT = 1
+    StubHandler.hang = 2
+    fetch.RETRY_BASE_DELAY = 0.1
+
+    problems = []
+    with fetch.FetchContext() as context:
+        started = time.perf_counter()
+        posts = fetch.get_database_entries("stub-database", context)
+        elapsed = time.perf_counter() - started
+        if [post["id"] for post in posts] != ["stub-page"]:
+            problems.append(f"database query returned {posts}")
+        if elapsed < 2 * RETRY_AFTER:
+            problems.append(f"two 429s with Retry-After: {RETRY_AFTER} were retried after {elapsed:.2f}s")
+
+        if fetch.with_retries(context.notion.pages.retrieve, page_id="stub-page")["id"] != "stub-page":
+            problems.append("page retrieve after a 502 failed")
+        if context.get_children("stub-page") != []:
+            problems.append("block children after a timeout failed")
+
+        with tempfile.TemporaryDirectory() as directory:
+            destination = Path(directory) / "stub.png"
+            fetch.with_retries(context.download, f"{base_url}/files/stub.png", destination)
+            if destination.read_bytes() != FILE_BODY:
+                problems.append("download after a 429, a 503 and a timeout returned the wrong bytes")
+
+    expected = {path: len(failures) + 1 for path, failures in FAILURES.items()}
+    if dict(StubHandler.requests) != expected:
+        problems.append(f"expected requests {expected}, got {dict(StubHandler.requests)}")
+    return problems
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check fetch.py's retries against a misbehaving stub Notion API")
+    parser.add_argument("--serve", action="store_true", help="Serve the stub until interrupted instead of checking")
+    parser.add_argument("--port", type=int, default=0, help="Port to serve on (default: any free port)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = start_stub(args.port)
+    if args.serve:
+        print(f"Stub Notion API on http://127.0.0.1:{server.server_port}, set NOTION_BASE_URL to it")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    problems = check(server)
+    server.shutdown()
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    print("All retry checks passed" if not problems else f"{len(problems)} retry checks failed")
+    sys.exit(1 if problems else 0)
@@ -1,18 +1,10 @@
 from scour.scour import scourString, generateDefaultOptions
+from functools import lru_cache
 import os
 
-def optimize_svg(input_file, output_file=None):
-    """
-    Optimize an SVG file using Scour.
-    
-    Args:
-        input_file (str): Path to the input SVG file
-        output_file (str, optional): Path to save the optimized SVG. If None, will overwrite input file.
-    """
-    # Read the input SVG file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        svg_content = f.read()
-    
+@lru_cache(maxsize=None)
+def scour_options():
+    """Scour options shared by every optimization"""
     # Get default options
     options = generateDefaultOptions()
     
@@ -25,9 +17,26 @@ def optimize_svg(input_file, output_file=None):
     options.group_collapse = True  # Collapse groups with common attributes
     options.digits = 3  # Number of significant digits to keep in numbers
     options.cdigits = 3  # Number of significant digits to keep in control points
+    return options
+
+def optimize_svg_string(svg_content):
+    """Optimize SVG markup in memory using Scour and return the result"""
+    return scourString(svg_content, scour_options())
+
+def optimize_svg(input_file, output_file=None):
+    """
+    Optimize an SVG file using Scour.
+    
+    Args:
+        input_file (str): Path to the input SVG file
+        output_file (str, optional): Path to save the optimized SVG. If None, will overwrite input file.
+    """
+    # Read the input SVG file
+    with open(input_file, 'r', encoding='utf-8') as f:
+        svg_content = f.read()
     
     # Optimize the SVG
-    optimized_svg = scourString(svg_content, options)
+    optimized_svg = optimize_svg_string(svg_content)
     
     # Determine output file path
     if output_file is None:
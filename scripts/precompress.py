@@ -0,0 +1,142 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+import shutil
+import threading
+import zlib
+import brotli
+from manifest import evict_least_recent, hash_bytes, hash_file
+from publish import prepare_output
+
+COMPRESSED_CACHE_DIR = Path(".cache/compressed")
+
+# Least recently used siblings are evicted once the cache grows past this
+COMPRESSED_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Scanning a large cache isn't free, so evict at most this often
+EVICTION_INTERVAL = 3600
+
+# Files worth compressing; images and fonts are already compressed
+COMPRESSIBLE_SUFFIXES = {
+    ".html", ".xml", ".svg", ".css", ".js", ".json", ".txt", ".md", ".webmanifest",
+}
+
+# Tiny files gain nothing once headers are counted
+MIN_SIZE = 256
+
+# Content-Encoding -> (file suffix, compress function taking the data and a level)
+ENCODINGS = {
+    "br": (".br", lambda data, level: brotli.compress(data, quality=level, mode=brotli.MODE_TEXT)),
+    # mtime=0 keeps the output reproducible, so unchanged files compress to identical bytes
+    "gzip": (".gz", lambda data, level: gzip.compress(data, compresslevel=level, mtime=0)),
+}
+
+# Part of every cache key, so a new compressor never serves output from an old one
+COMPRESSOR_VERSIONS = {"br": brotli.__version__, "gzip": zlib.ZLIB_RUNTIME_VERSION}
+
+# Maximum compression for deploys; "fast" keeps dev server rebuilds quick
+COMPRESSION_LEVELS = {
+    "best": {"br": 11, "gzip": 9},
+    "fast": {"br": 4, "gzip": 6},
+}
+
+
+def is_compressible(path):
+    return path.suffix in COMPRESSIBLE_SUFFIXES and path.stat().st_size >= MIN_SIZE
+
+
+def compress_file(path, encodings, levels, content_hash):
+    """
+    Write the given precompressed siblings of path.
+
+    Compressed files are cached in .cache/compressed keyed by the content hash, so
+    a file is only ever compressed once at each level, whichever way the site is
+    built, as long as .cache is kept (CI restores it between runs). A hit
+    refreshes the entry's mtime for evict().
+    """
+    data = None
+    for encoding in encodings:
+        suffix, compress = ENCODINGS[encoding]
+        key = hash_bytes(content_hash, encoding, levels[encoding], COMPRESSOR_VERSIONS[encoding])
+        cached = COMPRESSED_CACHE_DIR / key[:2] / f"{key[2:32]}{suffix}"
+        if cached.exists():
+            os.utime(cached)
+        else:
+            if data is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            # Unique per thread and process, then moved into place
+            partial = cached.with_name(f"{cached.name}.{os.getpid()}.{threading.get_ident()}.part")
+            partial.write_bytes(compress(data, levels[encoding]))
+            partial.replace(cached)
+
+        target = path.with_name(path.name + suffix)
+        prepare_output(target)
+        shutil.copyfile(cached, target)
+
+
+def evict(max_bytes=COMPRESSED_CACHE_MAX_BYTES, force=False):
+    """Delete the least recently used compressed files until the cache fits in max_bytes"""
+    return evict_least_recent(COMPRESSED_CACHE_DIR, max_bytes, EVICTION_INTERVAL, force)
+
+
+def precompress(publish_dir, manifest=None, workers=None, level="best"):
+    """
+    Write .br and .gz siblings for every compressible file in publish_dir.
+
+    The level is part of each sibling's digest, so siblings written at "fast"
+    are redone by the next incremental build at "best", while ones already at
+    "best" are left alone by a "fast" build.
+
+    With a manifest, only the files written by the current build are considered,
+    and siblings are only rewritten when their file changed since the last build.
+    Either way, unchanged contents come out of the cache instead of being compressed
+    again, so full builds with a kept .cache only pay for the files that changed.
+
+    A "fast" build takes any level, so the siblings of files the build didn't
+    rewrite are kept from the last build without hashing the files again.
+    """
+    publish_dir = Path(publish_dir)
+    if manifest is not None:
+        keys = sorted(manifest.current)
+        if level == "fast":
+            rewritten = set(manifest.rebuilt)
+            unchanged = []
+            for key in keys:
+                siblings = [key + suffix for suffix, _ in ENCODINGS.values()]
+                if key not in rewritten and all(manifest.previous.get(sibling) for sibling in siblings):
+                    manifest.carry(siblings)
+                    unchanged.append(key)
+            keys = sorted(set(keys) - set(unchanged))
+        paths = [publish_dir / key for key in keys]
+    else:
+        paths = sorted(path for path in publish_dir.rglob("*") if path.is_file())
+
+    levels = COMPRESSION_LEVELS[level]
+
+    jobs = []
+    for path in paths:
+        if not path.exists() or not is_compressible(path):
+            continue
+        content_hash = hash_file(path)
+        best = hash_bytes(content_hash, COMPRESSION_LEVELS["best"])
+        stale = []
+        for encoding, (suffix, _) in ENCODINGS.items():
+            sibling = path.with_name(path.name + suffix)
+            digest = hash_bytes(content_hash, levels)
+            # A sibling already compressed at a higher level is as good as one at this level
+            if manifest is not None and manifest.previous.get(manifest.key(sibling)) == best:
+                digest = best
+            if manifest is None or manifest.needs_update(sibling, digest):
+                stale.append(encoding)
+        if stale:
+            jobs.append((path, stale, content_hash))
+
+    # zlib and brotli release the GIL while compressing
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda job: compress_file(job[0], job[1], levels, job[2]), jobs))
+
+    evict()
+    return len(jobs)
@@ -1,9 +1,11 @@
 import re
+import argparse
 from collections import defaultdict
-import colorsys
-import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 from lxml import etree
-from optimize_svg import optimize_svg
+from optimize_svg import optimize_svg_string
 
 def hex_to_rgb(hex_color):
     # Remove # if present
@@ -32,77 +34,125 @@ def get_rgb_from_color(color):
         return rgb_to_rgb(color)
     return None
 
+# Colors declared in a style attribute, e.g. "fill: #000; stroke: rgb(1, 2, 3)"
+COLOR_PATTERN = re.compile(r'(?:fill|stroke|color):\s*(#[0-9a-fA-F]{3,6}|rgb\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*\)|rgba\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*,\s*[\d.]+\s*\))')
+
+COLOR_ATTRIBUTES = ('fill', 'stroke', 'color')
+
+# Header images are written as a dark-theme SVG plus a .light.svg twin
+THEME_VARIANTS = {'.svg': '#e0e0e0', '.light.svg': '#2c2c2c'}
+
+@lru_cache(maxsize=None)
+def is_dark_color(color):
+    # Diagrams reuse a handful of colors across thousands of nodes
+    rgb = get_rgb_from_color(color)
+    return bool(rgb and is_almost_black(rgb))
+
 def is_dark_element(element):
     # Check direct color attributes
-    for attr in ['fill', 'stroke', 'color']:
+    for attr in COLOR_ATTRIBUTES:
         if attr in element.attrib:
             color = element.attrib[attr]
             if color != 'none' and color != 'transparent':
-                rgb = get_rgb_from_color(color)
-                if rgb and is_almost_black(rgb):
+                if is_dark_color(color):
                     return True
     
     # Check style attribute
     if 'style' in element.attrib:
-        style = element.attrib['style']
-        color_pattern = re.compile(r'(?:fill|stroke|color):\s*(#[0-9a-fA-F]{3,6}|rgb\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*\)|rgba\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*,\s*[\d.]+\s*\))')
-        matches = color_pattern.findall(style)
-        for color in matches:
-            rgb = get_rgb_from_color(color)
-            if rgb and is_almost_black(rgb):
+        for color in COLOR_PATTERN.findall(element.attrib['style']):
+            if is_dark_color(color):
                 return True
     
     return False
 
-def process_svg(svg_file, fill_color):
-    # Parse the SVG file with lxml
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.parse(svg_file, parser)
-    root = tree.getroot()
-    
-    # Regular expression to find colors in style attributes
-    color_pattern = re.compile(r'(?:fill|stroke|color):\s*(#[0-9a-fA-F]{3,6}|rgb\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*\)|rgba\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*,\s*[\d.]+\s*\))')
-    
-    def process_element(element):
+class ThemedSVG:
+    """
+    An SVG parsed once with its dark elements removed, ready to be written out in
+    any number of fill colors.
+
+    Parsing records every attribute that has to be recolored, so emitting another
+    variant only rewrites those attributes on the same in-memory tree.
+    """
+
+    def __init__(self, svg_file):
+        parser = etree.XMLParser(remove_blank_text=True)
+        self.tree = etree.parse(str(svg_file), parser)
+        # (element, attribute, style split around the colors to replace or None)
+        self.slots = []
+        self._prune(self.tree.getroot())
+
+    def _prune(self, element):
         # Process children first (in reverse order to avoid index issues when removing)
         for child in reversed(list(element)):
-            if process_element(child):
+            if self._prune(child):
                 element.remove(child)
-        
-        # If element is not dark, update its colors
-        if not is_dark_element(element):
-            # Update direct color attributes
-            for attr in ['fill', 'stroke', 'color']:
-                if attr in element.attrib:
-                    color = element.attrib[attr]
-                    if color != 'none' and color != 'transparent':
-                        element.attrib[attr] = fill_color
-            
-            # Update style attribute
-            if 'style' in element.attrib:
-                style = element.attrib['style']
-                new_style = style
-                
-                # Find all color declarations in style
-                for match in color_pattern.finditer(style):
-                    color = match.group(1)
-                    rgb = get_rgb_from_color(color)
-                    if rgb and not is_almost_black(rgb):
-                        new_style = new_style.replace(color, fill_color)
-                
-                element.attrib['style'] = new_style
-        
-        return is_dark_element(element)
-    
-    # Process all elements
-    process_element(root)
-    
-    # Save the modified SVG back to the original file
-    tree.write(svg_file, pretty_print=True, xml_declaration=True, encoding='utf-8')
 
-    # Optimize the SVG
-    optimize_svg(svg_file)
+        if is_dark_element(element):
+            return True
+
+        for attr in COLOR_ATTRIBUTES:
+            color = element.attrib.get(attr)
+            if color is not None and color != 'none' and color != 'transparent':
+                self.slots.append((element, attr, None))
+
+        if 'style' in element.attrib:
+            style = element.attrib['style']
+            colors = {
+                color for color in COLOR_PATTERN.findall(style)
+                if get_rgb_from_color(color) and not is_dark_color(color)
+            }
+            if colors:
+                # Every occurrence of a matched color is replaced, like str.replace would
+                pattern = '|'.join(re.escape(color) for color in sorted(colors, key=len, reverse=True))
+                self.slots.append((element, 'style', re.split(f'(?:{pattern})', style)))
 
+        return False
+
+    def render(self, fill_color):
+        """Return the optimized SVG markup with every remaining color set to fill_color"""
+        if is_dark_color(fill_color):
+            # The original per-file pass would have removed every recolored element
+            raise ValueError(f"Fill color {fill_color} is too dark to theme with")
+
+        for element, attr, style_parts in self.slots:
+            if style_parts is None:
+                element.attrib[attr] = fill_color
+            else:
+                element.attrib[attr] = fill_color.join(style_parts)
+
+        svg = etree.tostring(self.tree, xml_declaration=True, encoding='utf-8')
+        return optimize_svg_string(svg.decode('utf-8'))
+
+    def write(self, output_file, fill_color):
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(self.render(fill_color))
+        return output_file
+
+def themed_path(svg_file, suffix):
+    """foo.svg + '.light.svg' -> foo.light.svg"""
+    svg_file = Path(svg_file)
+    return svg_file.with_name(svg_file.name[:-len('.svg')] + suffix)
+
+def theme_svg(svg_file, variants=THEME_VARIANTS):
+    """Parse svg_file once and write one optimized file per {suffix: fill_color} variant"""
+    themed = ThemedSVG(svg_file)
+    return [
+        str(themed.write(themed_path(svg_file, suffix), fill_color))
+        for suffix, fill_color in variants.items()
+    ]
+
+def theme_svgs(svg_files, variants=THEME_VARIANTS, workers=None):
+    """Theme several SVGs in parallel, one process per file at a time"""
+    svg_files = [str(svg_file) for svg_file in svg_files]
+    if len(svg_files) <= 1 or workers == 1:
+        return [theme_svg(svg_file, variants) for svg_file in svg_files]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(theme_svg, svg_files, [variants] * len(svg_files)))
+
+def process_svg(svg_file, fill_color):
+    # Recolor the SVG in place
+    ThemedSVG(svg_file).write(svg_file, fill_color)
     return svg_file
 
 def analyze_svg_colors(svg_file):
@@ -115,9 +165,6 @@ def analyze_svg_colors(svg_file):
     dark_colors = defaultdict(int)
     other_colors = defaultdict(int)
     
-    # Regular expression to find colors in style attributes
-    color_pattern = re.compile(r'(?:fill|stroke|color):\s*(#[0-9a-fA-F]{3,6}|rgb\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*\)|rgba\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*,\s*[\d.]+\s*\))')
-    
     def process_element(element):
         # Check direct color attributes
         for attr in ['fill', 'stroke', 'color']:
@@ -134,7 +181,7 @@ def analyze_svg_colors(svg_file):
         # Check style attribute
         if 'style' in element.attrib:
             style = element.attrib['style']
-            matches = color_pattern.findall(style)
+            matches = COLOR_PATTERN.findall(style)
             for color in matches:
                 rgb = get_rgb_from_color(color)
                 if rgb:
@@ -152,26 +199,67 @@ def analyze_svg_colors(svg_file):
     
     return dark_colors, other_colors
 
-def main():
-    import sys
-    
-    if len(sys.argv) != 3:
-        print("Usage: python process_svg.py <svg_file> <fill_color_hex>")
-        print("Example: python process_svg.py icon.svg FF0000")
-        sys.exit(1)
-    
-    svg_file = sys.argv[1]
-    fill_color = sys.argv[2]
-    
+def normalize_hex_color(fill_color):
     # Validate hex color
     hex_pattern = re.compile(r'^#?[0-9a-fA-F]{3,6}$')
     if not hex_pattern.match(fill_color):
-        print("Error: Fill color must be a valid hex color (e.g., FF0000)")
-        sys.exit(1)
+        raise argparse.ArgumentTypeError("Fill color must be a valid hex color (e.g., FF0000)")
     
     # Ensure hex color has # prefix
     if not fill_color.startswith('#'):
         fill_color = '#' + fill_color
+    return fill_color
+
+def parse_variant(value):
+    suffix, _, fill_color = value.partition('=')
+    if not suffix.endswith('.svg') or not fill_color:
+        raise argparse.ArgumentTypeError("Variants look like SUFFIX=COLOR, e.g. .light.svg=2c2c2c")
+    return suffix, normalize_hex_color(fill_color)
+
+def theme_directory(directory, variants, workers=None):
+    # Skip files that are themselves outputs of another variant, e.g. foo.light.svg
+    output_suffixes = [suffix for suffix in variants if suffix != '.svg']
+    svg_files = sorted(
+        svg_file for svg_file in Path(directory).glob('*.svg')
+        if not svg_file.name.endswith(tuple(output_suffixes))
+    )
+    for outputs in theme_svgs(svg_files, variants, workers):
+        print(" -> ".join([outputs[0]] + outputs[1:]) if len(outputs) > 1 else outputs[0])
+    print(f"\nThemed {len(svg_files)} SVG files into {len(variants)} variants each")
+
+def main():
+    import sys
+    
+    parser = argparse.ArgumentParser(
+        description="Remove dark elements from SVGs and recolor the rest",
+        epilog="Examples: python process_svg.py icon.svg FF0000\n"
+               "          python process_svg.py src/blog/img --variant .svg=e0e0e0 --variant .light.svg=2c2c2c",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('path', help="SVG file to recolor in place, or a directory of SVGs to theme")
+    parser.add_argument('fill_color', nargs='?', type=normalize_hex_color,
+                        help="Fill color when recoloring a single file")
+    parser.add_argument('--variant', action='append', type=parse_variant, metavar='SUFFIX=COLOR',
+                        help="Output suffix and fill color for directory mode, repeatable "
+                             "(default: the site's dark and light header variants)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processes used in directory mode (default: one per CPU core)")
+    args = parser.parse_args()
+
+    if Path(args.path).is_dir():
+        variants = dict(args.variant) if args.variant else THEME_VARIANTS
+        try:
+            theme_directory(args.path, variants, args.workers)
+        except Exception as e:
+            print(f"Error processing SVG files: {e}")
+            sys.exit(1)
+        return
+
+    if args.fill_color is None:
+        parser.error("a fill color is required when processing a single file")
+
+    svg_file = args.path
+    fill_color = args.fill_color
     
     try:
         # First, show the color analysis
@@ -182,7 +270,7 @@ def main():
         for color, count in sorted(dark_colors.items()):
             print(f"{color} (used {count} times)")
             
-        print("\nOther Colors (will be changed to {fill_color}):")
+        print(f"\nOther Colors (will be changed to {fill_color}):")
         print("-" * 40)
         for color, count in sorted(other_colors.items()):
             print(f"{color} (used {count} times)")
@@ -190,11 +278,11 @@ def main():
         # Process the SVG
         output_file = process_svg(svg_file, fill_color)
         print(f"\nSVG file has been updated in place: {output_file}")
-        print("Dark elements have been removed, and remaining elements have been colored with {fill_color}")
+        print(f"Dark elements have been removed, and remaining elements have been colored with {fill_color}")
             
     except Exception as e:
         print(f"Error processing SVG file: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,185 @@
+from contextlib import contextmanager
+import cProfile
+import datetime
+import json
+import sys
+import threading
+import time
+
+# How many of the slowest items to list per stage in the summary
+SLOWEST_ITEMS = 5
+
+
+class Stage:
+    """Accumulated timings and counters for one named stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+        self.count = 0
+        self.bytes = 0
+        # Item name -> {"wall", "cpu", "bytes"}
+        self.items = {}
+
+    def to_dict(self):
+        return {
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "calls": self.calls,
+            "count": self.count,
+            "bytes": self.bytes,
+            "items": self.items,
+        }
+
+
+class Profiler:
+    """
+    Collects per-stage and per-item wall and CPU time, counts and bytes.
+
+    Stages are timed with stage(); CPU time there is process-wide, so it includes
+    every thread working on the stage. Items within a stage are timed with item(),
+    whose CPU time is the calling thread's, so items can run concurrently. Work
+    done in other processes isn't seen.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def _stage(self, name):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = Stage(name)
+            return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work as part of the named stage; yields the Stage"""
+        stage = self._stage(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            with self.lock:
+                stage.wall += time.perf_counter() - wall
+                stage.cpu += time.process_time() - cpu
+                stage.calls += 1
+
+    @contextmanager
+    def item(self, stage_name, item_name):
+        """Time one item of a stage; yields a dict whose "bytes" can be set"""
+        stage = self._stage(stage_name)
+        record = {"wall": 0.0, "cpu": 0.0, "bytes": 0}
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.thread_time() - cpu
+            with self.lock:
+                stage.items[str(item_name)] = record
+
+    def add(self, stage_name, count=0, bytes=0):
+        """Add to a stage's counters without timing anything"""
+        stage = self._stage(stage_name)
+        with self.lock:
+            stage.count += count
+            stage.bytes += bytes
+
+    def to_dict(self):
+        return {
+            "command": " ".join(sys.argv),
+            "finished": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "total_wall": time.perf_counter() - self.started,
+            "total_cpu": time.process_time(),
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        """Human readable table of every stage, with its slowest items"""
+        rows = [("stage", "wall ms", "cpu ms", "calls", "count", "bytes")]
+        for stage in self.stages.values():
+            rows.append((
+                stage.name,
+                f"{stage.wall * 1000:.1f}",
+                f"{stage.cpu * 1000:.1f}",
+                str(stage.calls),
+                str(stage.count),
+                format_bytes(stage.bytes),
+            ))
+            slowest = sorted(stage.items.items(), key=lambda item: item[1]["wall"], reverse=True)
+            for name, record in slowest[:SLOWEST_ITEMS]:
+                rows.append((
+                    f"  {name}",
+                    f"{record['wall'] * 1000:.1f}",
+                    f"{record['cpu'] * 1000:.1f}",
+                    "",
+                    "",
+                    format_bytes(record["bytes"]) if record["bytes"] else "",
+                ))
+
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        lines = []
+        for index, row in enumerate(rows):
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+            lines.append("  ".join(cells))
+            if index == 0:
+                lines.append("  ".join("-" * width for width in widths))
+        lines.append(f"Total: {(time.perf_counter() - self.started) * 1000:.1f} ms wall, "
+                     f"{time.process_time() * 1000:.1f} ms cpu")
+        return "\n".join(lines)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def add_profile_arguments(parser):
+    """The --profile, --profile-json and --cprofile options shared by build.py and fetch.py"""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a table of where the time went when done",
+    )
+    parser.add_argument(
+        "--profile-json",
+        metavar="PATH",
+        help="Write per-stage and per-item timings as JSON to PATH",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="PATH",
+        help="Run under cProfile and dump the stats to PATH (read with python -m pstats)",
+    )
+
+
+@contextmanager
+def profiled(args):
+    """Apply the options added by add_profile_arguments around a run"""
+    profile = cProfile.Profile() if args.cprofile else None
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.cprofile)
+        if args.profile:
+            print(PROFILER.summary())
+        if args.profile_json:
+            PROFILER.write_json(args.profile_json)
+
+
+# The profiler every script records into
+PROFILER = Profiler()
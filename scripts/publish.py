@@ -0,0 +1,157 @@
+from pathlib import Path
+import fcntl
+import os
+import shutil
+import time
+
+# Every build is rendered into its own directory in here
+BUILDS_DIR = Path(".published")
+
+
+def prepare_output(path):
+    """
+    Make way for writing path in a staging directory.
+
+    Unchanged files in a staging directory are hard links to the live build, so
+    writing one in place would change the live site too. Unlinking it first gives
+    the new contents their own inode.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def lock_path(build_dir):
+    return Path(build_dir).with_name(Path(build_dir).name + ".lock")
+
+
+def lock_build(build_dir):
+    """
+    Hold a shared lock on a build so remove_old_builds leaves it alone while it's
+    being written or read. Returns the lock file; closing it releases the lock.
+    """
+    lock = open(lock_path(build_dir), "a")
+    fcntl.flock(lock, fcntl.LOCK_SH)
+    return lock
+
+
+def build_number(build_dir):
+    """The time_ns() a build directory is named after, or None for anything else"""
+    name = Path(build_dir).name
+    number = name.removeprefix("build-")
+    return int(number) if number != name and number.isdigit() else None
+
+
+def link_tree(source_dir, target_dir):
+    """Recreate source_dir at target_dir with hard links instead of copies"""
+    for root, _, files in os.walk(source_dir):
+        target_root = Path(target_dir) / Path(root).relative_to(source_dir)
+        target_root.mkdir(parents=True, exist_ok=True)
+        for name in files:
+            try:
+                os.link(Path(root) / name, target_root / name)
+            except OSError:
+                # Different filesystems or no hard link support
+                shutil.copy2(Path(root) / name, target_root / name)
+
+
+class StagedPublish:
+    """
+    Double-buffered publish directory.
+
+    published is a symlink to a complete build in .published/. A new build is
+    rendered into a fresh staging directory next to it, seeded with hard links to
+    the current build when it's incremental, and only replaces the symlink once it
+    has finished. Readers see either the old site or the new one, never a mix, and
+    a build that fails leaves the old one in place.
+
+    Builds being written hold a lock (see lock_build), as can anything reading
+    one. Publishing only deletes unlocked builds older than the new one, and keeps
+    the build it replaced to roll back to.
+    """
+
+    def __init__(self, publish_dir):
+        self.publish_dir = Path(publish_dir)
+        self.staging_dir = None
+        self.lock = None
+        self.in_place = False
+
+    def stage(self, incremental=True, in_place=False):
+        """
+        Create, lock and return the staging directory.
+
+        With in_place, return the live build itself instead, for the dev server:
+        there is nothing to link or swap, but readers can see it half-written and
+        a failed build can't be rolled back.
+        """
+        BUILDS_DIR.mkdir(exist_ok=True)
+        if in_place and incremental and self.publish_dir.is_symlink():
+            self.in_place = True
+            self.staging_dir = self.publish_dir.parent / os.readlink(self.publish_dir)
+            self.lock = lock_build(self.staging_dir)
+            return self.staging_dir
+
+        self.staging_dir = BUILDS_DIR / f"build-{time.time_ns()}"
+        # Locked before it exists, so a concurrent publish never sees it unlocked
+        self.lock = lock_build(self.staging_dir)
+        if incremental and self.publish_dir.exists():
+            link_tree(self.publish_dir, self.staging_dir)
+        else:
+            self.staging_dir.mkdir()
+        return self.staging_dir
+
+    def commit(self):
+        """Atomically point the publish directory at the staging directory"""
+        if self.in_place:
+            self.release()
+            return
+        target = os.path.relpath(self.staging_dir, self.publish_dir.parent)
+
+        # Directories from before publishing was staged are moved into place once
+        if self.publish_dir.exists() and not self.publish_dir.is_symlink():
+            shutil.rmtree(self.publish_dir)
+        previous = self.publish_dir.resolve() if self.publish_dir.is_symlink() else None
+
+        link = self.publish_dir.with_name(f".{self.publish_dir.name}.{os.getpid()}.link")
+        link.unlink(missing_ok=True)
+        link.symlink_to(target, target_is_directory=True)
+        # rename() over an existing symlink is atomic
+        os.replace(link, self.publish_dir)
+
+        self.remove_old_builds(keep={self.staging_dir.resolve(), previous})
+        self.release()
+
+    def abort(self):
+        """Throw away the staging directory of a failed build"""
+        if self.staging_dir is not None and not self.in_place:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            lock_path(self.staging_dir).unlink(missing_ok=True)
+        self.release()
+
+    def release(self):
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+    def remove_old_builds(self, keep):
+        """
+        Delete the builds older than this one that nobody holds a lock on, except
+        those in keep, including leftovers of crashed builds.
+        """
+        newest = build_number(self.staging_dir)
+        # A crash can leave a build without its lock file or the other way round
+        for build_dir in sorted({entry.with_suffix("") for entry in BUILDS_DIR.iterdir()}):
+            number = build_number(build_dir)
+            if number is None or number >= newest or build_dir.resolve() in keep:
+                continue
+            with open(lock_path(build_dir), "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Still being written or read
+                    continue
+                shutil.rmtree(build_dir, ignore_errors=True)
+                lock_path(build_dir).unlink(missing_ok=True)
@@ -0,0 +1,419 @@
+from pathlib import Path
+from collections import Counter
+import argparse
+import html
+import json
+import math
+import re
+import shutil
+import time
+import unicodedata
+from manifest import hash_bytes, hash_file
+from publish import prepare_output
+
+SEARCH_CACHE_DIR = Path(".cache/search")
+
+# Bump after changing the tokenizer, weights or file format
+INDEX_VERSION = 1
+
+# Terms are sharded by their first characters, so a query only fetches the shards of its terms
+SHARD_PREFIX_LENGTH = 2
+
+# Documents per file of the document table
+DOC_CHUNK_SIZE = 1000
+
+# Title and tag words count as if they appeared this many times in the post
+TITLE_WEIGHT = 5
+TAG_WEIGHT = 3
+
+# BM25 term frequency saturation; lengths are compared to a fixed reference rather
+# than the corpus average, so adding a post never changes another post's weights
+BM25_K1 = 1.2
+BM25_B = 0.75
+REFERENCE_LENGTH = 1500
+
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 32
+
+STOPWORDS = frozenset(
+    "an and are as at be but by for from has have he if in into is it its of on or "
+    "so such that the their then there these they this to was we were which will with "
+    "you your".split()
+)
+
+ARTICLE_PATTERN = re.compile(r"<article\b[^>]*>(.*?)</article>", re.DOTALL | re.IGNORECASE)
+# Formulas and scripts are markup rather than words
+SKIPPED_ELEMENT_PATTERN = re.compile(r"<(math|script|style|svg)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+COMBINING_MARK_PATTERN = re.compile(r"[\u0300-\u036f]")
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercased, accent-folded words of text; search.js splits queries the same way"""
+    text = COMBINING_MARK_PATTERN.sub("", unicodedata.normalize("NFKD", text)).lower()
+    return [
+        token for token in TOKEN_PATTERN.findall(text)
+        if MIN_TERM_LENGTH <= len(token) <= MAX_TERM_LENGTH
+        and token not in STOPWORDS
+        and not (token.isdigit() and len(token) > 4)
+    ]
+
+
+def article_text(page):
+    """The readable text of a rendered post, without the site chrome around it"""
+    match = ARTICLE_PATTERN.search(page)
+    content = match.group(1) if match else page
+    content = SKIPPED_ELEMENT_PATTERN.sub(" ", content)
+    return html.unescape(TAG_PATTERN.sub(" ", content))
+
+
+def term_weights(page, title="", tags=()):
+    """{term: weight from 1 to 255} for a rendered post"""
+    tokens = tokenize(article_text(page))
+    counts = Counter(tokens)
+    for token in tokenize(title):
+        counts[token] += TITLE_WEIGHT
+    for token in tokenize(" ".join(tags)):
+        counts[token] += TAG_WEIGHT
+
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / REFERENCE_LENGTH)
+    return {
+        term: max(1, round(255 * count / (count + norm)))
+        for term, count in counts.items()
+    }
+
+
+def shard_name(term):
+    """Hex of the term's first characters, so any script gives a safe file name"""
+    return term[:SHARD_PREFIX_LENGTH].encode("utf-8").hex()
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_shard(postings):
+    """
+    Serialize {term: {doc id: weight}} for one shard.
+
+    varint term count, then per term in byte order: varint length and UTF-8 bytes
+    of the term minus the shard prefix, varint posting count, and (doc id delta,
+    weight) varint pairs in doc id order.
+    """
+    out = bytearray()
+    encode_varint(len(postings), out)
+    for term in sorted(postings, key=lambda term: term.encode("utf-8")):
+        suffix = term[SHARD_PREFIX_LENGTH:].encode("utf-8")
+        encode_varint(len(suffix), out)
+        out += suffix
+        docs = postings[term]
+        encode_varint(len(docs), out)
+        previous = 0
+        for doc in sorted(docs):
+            encode_varint(doc - previous, out)
+            encode_varint(docs[doc], out)
+            previous = doc
+    return bytes(out)
+
+
+def decode_shard(data, prefix):
+    """Inverse of encode_shard; prefix is the shard's term prefix"""
+    postings = {}
+    count, position = decode_varint(data, 0)
+    for _ in range(count):
+        length, position = decode_varint(data, position)
+        term = prefix + data[position:position + length].decode("utf-8")
+        position += length
+        entries, position = decode_varint(data, position)
+        docs = {}
+        doc = 0
+        for _ in range(entries):
+            delta, position = decode_varint(data, position)
+            weight, position = decode_varint(data, position)
+            doc += delta
+            docs[doc] = weight
+        postings[term] = docs
+    return postings
+
+
+class SearchIndex:
+    """
+    Sharded inverted index of every post, written to search/ in the publish directory.
+
+    search/meta.json     version, document count and the list of shards
+    search/terms/X.bin   postings of every term starting with the characters hex X
+    search/docs/N.json   URL and title of documents N * DOC_CHUNK_SIZE and up
+
+    Posts are indexed from their rendered HTML. A post is only tokenized again
+    when its page changed, and only the shards of its old and new terms are
+    rewritten. What was indexed is kept in .cache/search and saved only once the
+    build is published, together with a token also written to meta.json, so a
+    failed build can't leave the two out of step.
+    """
+
+    def __init__(self, cache_dir=SEARCH_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.pending = None
+
+    def load_state(self):
+        try:
+            with open(self.cache_dir / "state.json", "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        return state if state.get("version") == INDEX_VERSION else None
+
+    def load_terms(self, post_id):
+        try:
+            with open(self.cache_dir / "terms" / f"{post_id}.json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def empty_state(self):
+        return {"version": INDEX_VERSION, "token": None, "posts": {}, "free": [], "next": 0}
+
+    def update(self, publish_dir, documents, manifest=None):
+        """
+        Bring search/ in publish_dir up to date with documents and return how many were indexed.
+
+        documents are (post id, path of the rendered page, URL, title, tags, digest),
+        where digest is anything that changes with the page, or None to hash the page.
+        """
+        output_dir = Path(publish_dir) / "search"
+        state = self.load_state()
+        meta = read_json(output_dir / "meta.json")
+        if state is None or meta is None or meta.get("token") != state["token"]:
+            state = self.empty_state()
+
+        digests = {
+            post_id: hash_bytes(digest or hash_file(page_path), title, tags)
+            for post_id, page_path, url, title, tags, digest in documents
+        }
+        posts = state["posts"]
+        removed = [post_id for post_id in posts if post_id not in digests]
+        changed = [post_id for post_id, digest in digests.items() if post_id not in posts or posts[post_id][1] != digest]
+
+        # Postings can only be removed for terms we know a post had, with their weights
+        old_terms = {post_id: self.load_terms(post_id) for post_id in removed + changed if post_id in posts}
+        if any(terms is None for terms in old_terms.values()):
+            state = self.empty_state()
+            posts, removed, changed, old_terms = state["posts"], [], list(digests), {}
+        rebuild = not posts
+        if rebuild:
+            # Nothing to build on; start over from every post
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        new_terms = {}
+        changed_ids = set(changed)
+        for post_id, page_path, url, title, tags, digest in documents:
+            if post_id in changed_ids:
+                with open(page_path, "r", encoding="utf-8") as f:
+                    new_terms[post_id] = term_weights(f.read(), title, tags)
+
+        # Freed document ids are reused lowest first, keeping the id space dense
+        doc_ids = {post_id: posts[post_id][0] for post_id in old_terms}
+        free = sorted(state["free"] + [posts.pop(post_id)[0] for post_id in removed])
+        for post_id in changed:
+            if post_id not in posts:
+                doc = free.pop(0) if free else state["next"]
+                state["next"] = max(state["next"], doc + 1)
+                posts[post_id] = [doc, None]
+            posts[post_id][1] = digests[post_id]
+            doc_ids[post_id] = posts[post_id][0]
+        state["free"] = free
+
+        # Weights are quantized, so a small edit leaves most of a post's postings as they
+        # were; only shards with a posting added, removed or reweighted are rewritten
+        changed_shards = {}
+        for post_id in old_terms.keys() | new_terms.keys():
+            old, new = old_terms.get(post_id, {}), new_terms.get(post_id, {})
+            for term in old.keys() | new.keys():
+                if old.get(term) != new.get(term):
+                    changed_shards.setdefault(shard_name(term), []).append((term, doc_ids[post_id], new.get(term)))
+
+        terms_dir = output_dir / "terms"
+        for name, changes in changed_shards.items():
+            path = terms_dir / f"{name}.bin"
+            prefix = bytes.fromhex(name).decode("utf-8")
+            postings = decode_shard(path.read_bytes(), prefix) if path.exists() else {}
+            for term, doc, weight in changes:
+                if weight is None:
+                    postings.get(term, {}).pop(doc, None)
+                else:
+                    postings.setdefault(term, {})[doc] = weight
+            postings = {term: docs for term, docs in postings.items() if docs}
+            prepare_output(path)
+            if postings:
+                path.write_bytes(encode_shard(postings))
+
+        shards = sorted(path.stem for path in terms_dir.glob("*.bin")) if terms_dir.exists() else []
+        if manifest is not None:
+            for name in shards:
+                manifest.needs_update(terms_dir / f"{name}.bin", hash_file(terms_dir / f"{name}.bin"))
+
+        chunks = {}
+        for post_id, page_path, url, title, tags, digest in documents:
+            doc = posts[post_id][0]
+            chunks.setdefault(doc // DOC_CHUNK_SIZE, {})[str(doc)] = [url, title]
+        for number, chunk in chunks.items():
+            write_json(output_dir / "docs" / f"{number}.json", chunk, manifest)
+
+        if changed or removed or state["token"] is None:
+            state["token"] = f"{time.time_ns():x}"
+        write_json(
+            output_dir / "meta.json",
+            {
+                "version": INDEX_VERSION,
+                "token": state["token"],
+                "documents": len(posts),
+                "shard_prefix_length": SHARD_PREFIX_LENGTH,
+                "doc_chunk_size": DOC_CHUNK_SIZE,
+                # search.js tokenizes queries with these, so the two can't drift apart
+                "min_term_length": MIN_TERM_LENGTH,
+                "max_term_length": MAX_TERM_LENGTH,
+                "stopwords": sorted(STOPWORDS),
+                "shards": shards,
+            },
+            manifest,
+        )
+
+        self.pending = (state, new_terms, removed, rebuild)
+        return len(new_terms)
+
+    def save(self):
+        """Persist what update() indexed; call once the build has been published"""
+        if self.pending is None:
+            return
+        state, new_terms, removed, rebuild = self.pending
+        terms_dir = self.cache_dir / "terms"
+        if rebuild:
+            shutil.rmtree(terms_dir, ignore_errors=True)
+        terms_dir.mkdir(parents=True, exist_ok=True)
+        for post_id, terms in new_terms.items():
+            with open(terms_dir / f"{post_id}.json", "w", encoding="utf-8") as f:
+                json.dump(terms, f)
+        for post_id in removed:
+            (terms_dir / f"{post_id}.json").unlink(missing_ok=True)
+        with open(self.cache_dir / "state.json", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        self.pending = None
+
+
+def read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path, data, manifest=None):
+    content = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    if manifest is not None and not manifest.needs_update(path, hash_bytes(content)):
+        return
+    prepare_output(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+class SearchReader:
+    """
+    Query an index written by SearchIndex, the same way search.js does in the browser.
+
+    Shards and document chunks are loaded on first use and kept, like the browser
+    caches the files it fetched.
+    """
+
+    def __init__(self, search_dir):
+        self.search_dir = Path(search_dir)
+        self.meta = read_json(self.search_dir / "meta.json")
+        self.shard_names = set(self.meta["shards"])
+        self.shards = {}
+        self.chunks = {}
+
+    def shard(self, name):
+        if name not in self.shards:
+            prefix = bytes.fromhex(name).decode("utf-8")
+            path = self.search_dir / "terms" / f"{name}.bin"
+            self.shards[name] = decode_shard(path.read_bytes(), prefix) if name in self.shard_names else {}
+        return self.shards[name]
+
+    def postings(self, term, prefix=False):
+        """{doc id: weight} for term, or for every term starting with it when prefix is set"""
+        shard = self.shard(shard_name(term))
+        if not prefix:
+            return shard.get(term, {})
+        merged = {}
+        for candidate, docs in shard.items():
+            if candidate.startswith(term):
+                for doc, weight in docs.items():
+                    merged[doc] = max(weight, merged.get(doc, 0))
+        return merged
+
+    def document(self, doc):
+        number = doc // self.meta["doc_chunk_size"]
+        if number not in self.chunks:
+            self.chunks[number] = read_json(self.search_dir / "docs" / f"{number}.json")
+        return self.chunks[number][str(doc)]
+
+    def search(self, query, limit=10):
+        """
+        Return up to limit (score, URL, title) for posts containing every word of query.
+
+        The last word also matches longer words, so results show up while typing.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        total = self.meta["documents"]
+        scores = None
+        for index, term in enumerate(terms):
+            postings = self.postings(term, prefix=index == len(terms) - 1)
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            term_scores = {doc: weight * idf for doc, weight in postings.items()}
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc: score + term_scores[doc] for doc, score in scores.items() if doc in term_scores}
+            if not scores:
+                return []
+
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(score, *self.document(doc)) for doc, score in best]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the search index of a built site")
+    parser.add_argument("query", nargs="+")
+    parser.add_argument("--index", type=Path, default=Path("published/search"), help="The search/ directory of a build")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    reader = SearchReader(args.index)
+    started = time.perf_counter()
+    results = reader.search(" ".join(args.query), args.limit)
+    elapsed = time.perf_counter() - started
+    for score, url, title in results:
+        print(f"{score:8.1f}  {title}  {url}")
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
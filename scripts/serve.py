@@ -1,68 +1,529 @@
+import argparse
+import email.utils
+import hashlib
 import http.server
-import socketserver
+import json
+import mimetypes
 from pathlib import Path
 import os
+import queue
+import re
+import urllib.parse
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import subprocess
 import threading
-import sys
+import traceback
+import build
+from manifest import hash_file
 
 # Configuration
 PORT = 8000
 DIRECTORY = "published"
 
-class Handler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
+# Content-Encoding -> suffix of the precompressed sibling written by the build, in order of preference
+PRECOMPRESSED = {"br": ".br", "gzip": ".gz"}
+
+# Seconds without new change events before a rebuild starts
+DEBOUNCE = 0.03
+
+# Server-Sent Events endpoint the injected live reload client listens on
+LIVE_RELOAD_PATH = "/__livereload"
+LIVE_RELOAD_PING_INTERVAL = 15
+
+# styles.3f9a1c2b.css, photo.3f9a1c2b-960w.webp: the name changes whenever the content does
+FINGERPRINTED_PATTERN = re.compile(r"\.[0-9a-f]{8}(?:-\d+w)?\.\w+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Everything else is revalidated on every use, which is cheap with ETags
+DEFAULT_CACHE_CONTROL = "no-cache"
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_identity(stat):
+    """Changes whenever a file is rewritten or replaced"""
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class Representation:
+    """
+    What is known about one file of a Resource when the route table was built.
+
+    Builds can rewrite a file after that, so responses describe the file they
+    actually open: describe() checks the open file against what was recorded
+    and only hashes it again when it changed.
+    """
+
+    def __init__(self, path, etag_suffix=""):
+        self.path = path
+        self.etag_suffix = etag_suffix
+        stat = path.stat()
+        self.identity = file_identity(stat)
+        # Strong validator: changes exactly when the bytes do
+        self.etag = self.make_etag(hash_file(path))
+
+    def make_etag(self, digest):
+        return f'"{digest[:32]}{self.etag_suffix}"'
+
+    def describe(self, f):
+        """(size, etag, mtime) of the open file f"""
+        stat = os.fstat(f.fileno())
+        etag = self.etag
+        if file_identity(stat) != self.identity:
+            etag = self.make_etag(hashlib.file_digest(f, "sha256").hexdigest())
+            f.seek(0)
+        return stat.st_size, etag, stat.st_mtime
+
+
+class Resource:
+    """A file in the publish directory, with its validators and precompressed variants"""
+
+    def __init__(self, path):
+        self.path = path
+        self.identity = Representation(path)
+        self.content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.cache_control = (
+            IMMUTABLE_CACHE_CONTROL if FINGERPRINTED_PATTERN.search(path.name) else DEFAULT_CACHE_CONTROL
+        )
+        # Content-Encoding -> Representation
+        self.variants = {}
+        for encoding, suffix in PRECOMPRESSED.items():
+            variant = path.with_name(path.name + suffix)
+            if variant.exists():
+                self.variants[encoding] = Representation(variant, f"-{encoding}")
+
+
+def urls_for(key):
+    """Every URL a file in the publish directory is served at, the canonical one first"""
+    url = "/" + key
+    if key == "index.html" or key.endswith("/index.html"):
+        return [url[: -len("index.html")], url]
+    if key.endswith(".html"):
+        return [url, url[: -len(".html")]]
+    return [url]
+
+
+class RouteTable:
+    """
+    URL path -> Resource for everything in the publish directory.
+
+    Clean URLs are resolved once when the table is built instead of with a
+    filesystem lookup per request. rebuild() swaps in a new table atomically, so
+    requests in flight during a rebuild see either the old or the new one.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.routes = {}
+        self.redirects = {}
+
+    def rebuild(self):
+        routes, redirects = {}, {}
+        for path in sorted(self.directory.rglob("*")):
+            if not path.is_file() or path.suffix in PRECOMPRESSED.values():
+                continue
+            resource = Resource(path)
+            for url in urls_for(path.relative_to(self.directory).as_posix()):
+                routes.setdefault(url, resource)
+
+        # /blog -> /blog/ unless there is a blog.html
+        for url in list(routes):
+            if url.endswith("/") and url != "/" and url[:-1] not in routes:
+                redirects[url[:-1]] = url
+
+        self.routes, self.redirects = routes, redirects
+        return len(routes)
+
+    def resolve(self, url):
+        return self.routes.get(url)
+
+
+class LiveReload:
+    """
+    Server-Sent Events channel that tells open pages what the last build changed.
+
+    Each connected page gets a queue; publish() puts the same message on all of
+    them and the handler threads stream it out.
+    """
+
+    def __init__(self):
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def connect(self):
+        client = queue.Queue()
+        with self.lock:
+            self.clients.add(client)
+        return client
+
+    def disconnect(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def publish(self, message):
+        with self.lock:
+            for client in self.clients:
+                client.put(message)
+
+
+# Added to every HTML response unless --no-live-reload is given, never to the files in published/
+LIVE_RELOAD_SNIPPET = """<script>
+(() => {
+    const source = new EventSource('%s');
+    source.addEventListener('change', event => {
+        const change = JSON.parse(event.data);
+        // Stylesheet-only change: point <link>s at the new fingerprinted files
+        if (change.stylesheets) {
+            let swapped = false;
+            document.querySelectorAll('link[rel="stylesheet"]').forEach(link => {
+                const url = new URL(link.href);
+                const logical = url.pathname.replace(/^\\/static\\//, '').replace(/\\.[0-9a-f]{8}(\\.css)$/, '$1');
+                if (change.stylesheets[logical]) {
+                    link.href = '/static/' + change.stylesheets[logical];
+                    swapped = true;
+                }
+            });
+            if (swapped) return;
+        }
+        const here = decodeURI(location.pathname);
+        if (change.urls.includes(here)) location.reload();
+    });
+})();
+</script>""" % LIVE_RELOAD_PATH
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # Keep connections open between requests
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+    routes = None
+    live_reload = None
 
     def do_GET(self):
-        if '.' not in self.path.split('/')[-1]:
-            original_path = self.path
-            self.path = f"{self.path}.html"
-            
-            if not Path(DIRECTORY + self.path).exists():
-                self.path = original_path
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        url = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if url == LIVE_RELOAD_PATH and self.live_reload is not None:
+            self.stream_changes()
+            return
+        if url in self.routes.redirects:
+            query = urllib.parse.urlsplit(self.path).query
+            self.send_response(301)
+            self.send_header("Location", self.routes.redirects[url] + (f"?{query}" if query else ""))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        resource = self.routes.resolve(url)
+        if resource is None:
+            self.send_error(404, "File not found")
+            return
+
+        if self.live_reload is not None and resource.content_type == "text/html":
+            self.respond_with_snippet(resource, send_body)
+            return
+
+        # Ranges are byte offsets into the identity encoding, so they are never served compressed
+        range_header = self.headers.get("Range")
+        encoding = None if range_header else self.precompressed_encoding(resource)
+        representation = resource.variants[encoding] if encoding else resource.identity
+
+        try:
+            f = open(representation.path, "rb")
+        except FileNotFoundError:
+            # Removed by a build since the route table was made
+            self.send_error(404, "File not found")
+            return
+        with f:
+            # Everything below describes the file that is actually sent, even if a
+            # build rewrote it since the route table was made
+            size, etag, mtime = representation.describe(f)
+            last_modified = email.utils.formatdate(mtime, usegmt=True)
+
+            if self.not_modified(etag, mtime):
+                self.send_response(304)
+                self.send_validators(resource, etag, last_modified)
+                self.end_headers()
+                return
+
+            start, end = 0, size - 1
+            status = 200
+            if range_header and self.headers.get("If-Range", etag) in (etag, last_modified):
+                byte_range = self.parse_range(range_header, size)
+                if byte_range is None:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if byte_range != (0, size - 1) or size == 0:
+                    status = 206
+                start, end = byte_range
+
+            self.send_response(status)
+            self.send_header("Content-Type", resource.content_type)
+            self.send_header("Content-Length", str(max(end - start + 1, 0)))
+            self.send_header("Accept-Ranges", "bytes")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_validators(resource, etag, last_modified)
+            self.end_headers()
+
+            if send_body and end >= start:
+                # Zero-copy from the page cache to the socket where the OS supports it
+                self.connection.sendfile(f, offset=start, count=end - start + 1)
+
+    def respond_with_snippet(self, resource, send_body):
+        """Serve an HTML page with the live reload client added"""
+        try:
+            f = open(resource.path, "rb")
+        except FileNotFoundError:
+            self.send_error(404, "File not found")
+            return
+        with f:
+            _, etag, mtime = resource.identity.describe(f)
+            content = f.read().decode("utf-8")
+        # A different representation from the file on disk, so a different validator
+        etag = f'{etag[:-1]}-live"'
+        last_modified = email.utils.formatdate(mtime, usegmt=True)
+        # Always sent uncompressed, so unlike the file it doesn't vary with Accept-Encoding
+        if self.not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_validators(resource, etag, last_modified, negotiated=False)
+            self.end_headers()
+            return
+
+        position = content.rfind("</body>")
+        if position == -1:
+            position = len(content)
+        body = (content[:position] + LIVE_RELOAD_SNIPPET + content[position:]).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", resource.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_validators(resource, etag, last_modified, negotiated=False)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def stream_changes(self):
+        """Hold the connection open and forward build notifications as Server-Sent Events"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # The stream has no length, so it ends when the connection does
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        client = self.live_reload.connect()
+        try:
+            while True:
+                try:
+                    message = client.get(timeout=LIVE_RELOAD_PING_INTERVAL)
+                    self.wfile.write(f"event: change\ndata: {json.dumps(message)}\n\n".encode("utf-8"))
+                except queue.Empty:
+                    # Comments keep proxies from timing out and reveal closed connections
+                    self.wfile.write(b": ping\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.live_reload.disconnect(client)
+
+    def send_validators(self, resource, etag, last_modified, negotiated=True):
+        """Validators and caching headers; negotiated responses pick between the precompressed variants"""
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Cache-Control", resource.cache_control)
+        if negotiated and resource.variants:
+            self.send_header("Vary", "Accept-Encoding")
+
+    def not_modified(self, etag, mtime):
+        """Whether the client's cached copy is still current"""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # Weak comparison, as If-None-Match calls for
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or etag in tags
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    @staticmethod
+    def parse_range(header, size):
+        """(start, end) of a single byte range, or None if it can't be satisfied"""
+        match = RANGE_PATTERN.match(header.strip())
+        if match is None:
+            # Multiple or malformed ranges: fall back to the whole file
+            return (0, size - 1)
+        first, last = match.groups()
+        if not first and not last:
+            return (0, size - 1)
+        if not first:
+            # bytes=-500 is the last 500 bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return None
+        return start, end
 
-        return super().do_GET()
+    def precompressed_encoding(self, resource):
+        """The best precompressed variant of resource that the client accepts"""
+        accepted = {
+            part.split(';')[0].strip()
+            for part in self.headers.get('Accept-Encoding', '').split(',')
+            if not part.strip().endswith(';q=0')
+        }
+        for encoding in resource.variants:
+            if encoding in accepted:
+                return encoding
+        return None
 
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         super().end_headers()
 
-class SourceChangeHandler(FileSystemEventHandler):
-    def __init__(self):
-        self.last_build = 0
-        self.build_cooldown = 2  # seconds
+class Rebuilder(threading.Thread):
+    """
+    Rebuilds the site in this process whenever sources change.
+
+    Change events are collected into a set of paths and only acted on once no new
+    event has arrived for DEBOUNCE seconds, so a burst of saves (or an editor's
+    write-to-temp-then-rename) becomes a single build that includes the last edit.
+    Events that arrive while a build runs are picked up by the next one. Builds
+    reuse the already imported build module, so templates, the Markdown converter
+    and file hashes stay warm and only outputs whose inputs changed are rewritten,
+    in place in the live build.
+    """
+
+    def __init__(self, routes, live_reload=None):
+        super().__init__(daemon=True)
+        self.routes = routes
+        self.live_reload = live_reload
+        self.pending = set()
+        self.last_event = 0
+        self.changed = threading.Condition()
+
+    def schedule(self, path):
+        with self.changed:
+            self.pending.add(path)
+            self.last_event = time.monotonic()
+            self.changed.notify()
+
+    def run(self):
+        while True:
+            with self.changed:
+                while not self.pending:
+                    self.changed.wait()
+                # Wait for the burst to settle
+                while (remaining := self.last_event + DEBOUNCE - time.monotonic()) > 0:
+                    self.changed.wait(remaining)
+                changed_paths, self.pending = self.pending, set()
+            self.rebuild(changed_paths)
 
-    def on_modified(self, event):
-        # Skip if the change is in the published directory
-        if DIRECTORY in event.src_path:
+    def rebuild(self, changed_paths):
+        start = time.perf_counter()
+        previous_assets = dict(build.ASSETS.mapping)
+        try:
+            # Full compression is left to real builds; it would dominate small rebuilds.
+            # Writing into the live build skips linking a staged copy and swapping it in
+            manifest, removed = build.build(
+                incremental=True, compression="fast", in_place=True, changed_paths=changed_paths
+            )
+        except Exception:
+            print(f"Error during rebuild after changes to {', '.join(sorted(changed_paths))}:")
+            traceback.print_exc()
             return
+        self.routes.rebuild()
+        elapsed = (time.perf_counter() - start) * 1000
+        print(
+            f"{len(changed_paths)} changed file(s): rebuilt {len(manifest.rebuilt)} outputs, "
+            f"removed {len(removed)} in {elapsed:.0f} ms"
+        )
+
+        if self.live_reload is not None and (manifest.rebuilt or removed):
+            self.live_reload.publish(self.describe_changes(changed_paths, manifest.rebuilt + removed, previous_assets))
+
+    @staticmethod
+    def describe_changes(changed_paths, changed_outputs, previous_assets):
+        """The message sent to pages: every URL whose response changed, plus new stylesheets"""
+        message = {
+            "urls": sorted(
+                {
+                    url
+                    for key in changed_outputs
+                    if not key.endswith(tuple(PRECOMPRESSED.values()))
+                    for url in urls_for(key)
+                }
+            ),
+        }
+        # Pages were only rewritten to point at the new stylesheets, so swap those in place
+        if changed_paths and all(path.endswith(".css") for path in changed_paths):
+            message["stylesheets"] = {
+                logical: url
+                for logical, url in build.ASSETS.mapping.items()
+                if logical.endswith(".css") and previous_assets.get(logical) != url
+            }
+        return message
+
+
+class SourceChangeHandler(FileSystemEventHandler):
+    def __init__(self, rebuilder):
+        self.rebuilder = rebuilder
 
-        # Implement cooldown to prevent multiple rapid rebuilds
-        current_time = time.time()
-        if current_time - self.last_build < self.build_cooldown:
+    def on_any_event(self, event):
+        # Reads don't change anything
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        if event.is_directory and event.event_type == "modified":
             return
 
-        self.last_build = current_time
-        print("\nChange detected in source files. Rebuilding...")
-        try:
-            # Use the same Python interpreter that's running this script
-            subprocess.run([sys.executable, "scripts/build.py"], check=True)
-            print("Rebuild complete. Ready for requests.")
-        except subprocess.CalledProcessError as e:
-            print(f"Error during rebuild: {e}")
-
-def start_file_watcher():
-    event_handler = SourceChangeHandler()
+        # Moves affect both the old and the new location
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path and not is_ignored(path):
+                self.rebuilder.schedule(path)
+
+
+def is_ignored(path):
+    """Editor swap, backup and lock files"""
+    name = os.path.basename(path)
+    return name.startswith((".#", "#")) or name.endswith(("~", ".swp", ".swx", ".tmp"))
+
+
+def start_file_watcher(rebuilder):
+    event_handler = SourceChangeHandler(rebuilder)
     observer = Observer()
     observer.schedule(event_handler, "src", recursive=True)
     observer.start()
     return observer
 
-def serve():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve published/ and rebuild it when src/ changes")
+    parser.add_argument(
+        "--no-live-reload",
+        dest="live_reload",
+        action="store_false",
+        help="Serve pages exactly as built, precompressed and with ranges, instead of adding the live reload client",
+    )
+    return parser.parse_args()
+
+
+def serve(live_reload=True):
     # Ensure we're in the project root
     os.chdir(Path(__file__).parent.parent)
     
@@ -72,11 +533,22 @@ def serve():
         print("Please run the build script first: python scripts/build.py")
         return
 
+    routes = RouteTable(DIRECTORY)
+    live_reload = LiveReload() if live_reload else None
+    Handler.routes = routes
+    Handler.live_reload = live_reload
+    rebuilder = Rebuilder(routes, live_reload)
+
+    # Bring published/ up to date and warm up templates and caches for the first edit
+    rebuilder.rebuild(set())
+    print(f"Indexed {len(routes.routes)} routes")
+
     # Start file watcher in a separate thread
-    observer = start_file_watcher()
+    rebuilder.start()
+    observer = start_file_watcher(rebuilder)
 
-    # Create server
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
+    # One thread per connection, so a slow download doesn't hold up other requests
+    with http.server.ThreadingHTTPServer(("", PORT), Handler) as httpd:
         print(f"Serving files from /{DIRECTORY} at http://localhost:{PORT}")
         print("Watching for changes in /src directory...")
         try:
@@ -88,4 +560,5 @@ def serve():
             httpd.shutdown()
 
 if __name__ == "__main__":
-    serve()
\ No newline at end of file
+    args = parse_args()
+    serve(args.live_reload)
\ No newline at end of file
@@ -0,0 +1,159 @@
+from pathlib import Path
+from xml.sax.saxutils import escape
+import hashlib
+import itertools
+import os
+from manifest import update_digest
+
+SITE_URL = "https://vtasca.dev"
+
+# Limits of a single sitemap file from the sitemaps.org protocol
+MAX_URLS = 50_000
+MAX_BYTES = 50 * 1024 * 1024
+
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>"
+URLSET_HEADER = XML_DECLARATION + '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+URLSET_FOOTER = "</urlset>"
+INDEX_HEADER = XML_DECLARATION + '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+INDEX_FOOTER = "</sitemapindex>"
+
+# Numbers the temporary files sitemaps are written to before they're moved into place
+_temp_numbers = itertools.count()
+
+
+class RouteRegistry:
+    """
+    Every output the current build produces, with when its content last changed.
+
+    Pages register themselves as they are rendered, or skipped because they're up
+    to date, so the sitemap never has to rescan the publish directory.
+    """
+
+    def __init__(self):
+        self.publish_dir = None
+        self.routes = {}
+
+    def reset(self, publish_dir):
+        self.publish_dir = Path(publish_dir)
+        self.routes = {}
+
+    def add(self, output_path, lastmod=None):
+        key = Path(output_path).relative_to(self.publish_dir).as_posix()
+        self.routes[key] = lastmod
+
+    def pages(self):
+        """(URL, lastmod) of every HTML page, in URL order"""
+        return sorted(
+            (page_url(key), lastmod) for key, lastmod in self.routes.items() if key.endswith(".html")
+        )
+
+
+def page_url(key):
+    """blog/index.html -> https://vtasca.dev/blog/, contact.html -> https://vtasca.dev/contact"""
+    if key == "index.html" or key.endswith("/index.html"):
+        key = key[:-len("index.html")]
+    elif key.endswith(".html"):
+        key = key[:-len(".html")]
+    return f"{SITE_URL}/{key}"
+
+
+def entry(tag, loc, lastmod=None):
+    """One <url> or <sitemap> element"""
+    lastmod = f"<lastmod>{escape(lastmod)}</lastmod>" if lastmod else ""
+    return f"<{tag}><loc>{escape(loc)}</loc>{lastmod}</{tag}>"
+
+
+class SitemapFile:
+    """
+    One sitemap file written element by element, hashed as it goes so neither
+    its elements nor its content have to be held in memory.
+
+    It is written to a temporary file next to its destination and only moved
+    into place by finish() if the manifest says the content changed.
+    """
+
+    def __init__(self, directory, header, footer):
+        self.footer = footer
+        self.digest = hashlib.sha256()
+        # Bytes the file will have with its footer, and the number of elements in it
+        self.size = len(header) + len(footer)
+        self.count = 0
+        # W3C datetimes in the same format compare chronologically as strings
+        self.lastmod = None
+        self.temp_path = Path(directory) / f".sitemap-{os.getpid()}-{next(_temp_numbers)}.tmp"
+        self.file = open(self.temp_path, "w", encoding="utf-8")
+        self.file.write(header)
+        update_digest(self.digest, header)
+
+    def fits(self, element, max_urls=MAX_URLS, max_bytes=MAX_BYTES):
+        """Whether element can be added without going over the protocol limits; the first always fits"""
+        return self.count == 0 or (self.count < max_urls and self.size + len(element.encode("utf-8")) <= max_bytes)
+
+    def write(self, element, lastmod=None):
+        self.file.write(element)
+        update_digest(self.digest, element)
+        self.size += len(element.encode("utf-8"))
+        self.count += 1
+        if lastmod and (self.lastmod is None or lastmod > self.lastmod):
+            self.lastmod = lastmod
+
+    def finish(self, path, manifest=None):
+        """Move the file to path unless the manifest has it already, and return whether it did"""
+        self.file.write(self.footer)
+        self.file.close()
+        if manifest is not None and not manifest.needs_update(path, self.digest.hexdigest()):
+            self.temp_path.unlink()
+            return False
+        # A new inode, so a hard link to the live build is replaced rather than written through
+        os.replace(self.temp_path, path)
+        return True
+
+    def discard(self):
+        self.file.close()
+        self.temp_path.unlink(missing_ok=True)
+
+
+def write_sitemaps(publish_dir, routes, manifest=None, max_urls=MAX_URLS, max_bytes=MAX_BYTES):
+    """
+    Write sitemap.xml for every page in routes and return the files written.
+
+    Past the protocol limits the URLs are split over sitemap-1.xml, sitemap-2.xml
+    and so on, and sitemap.xml becomes a sitemap index pointing at them. Each file
+    is streamed to disk as its URLs are serialized, keeping only the lastmod of
+    finished parts for the index.
+    """
+    publish_dir = Path(publish_dir)
+    publish_dir.mkdir(parents=True, exist_ok=True)
+    written, parts = [], []
+
+    def finish(sitemap, path):
+        if sitemap.finish(path, manifest):
+            written.append(path)
+
+    sitemap = SitemapFile(publish_dir, URLSET_HEADER, URLSET_FOOTER)
+    try:
+        for loc, lastmod in routes.pages():
+            element = entry("url", loc, lastmod)
+            if not sitemap.fits(element, max_urls, max_bytes):
+                # Only now is it known that there's more than one file
+                name = f"sitemap-{len(parts) + 1}.xml"
+                parts.append((name, sitemap.lastmod))
+                finish(sitemap, publish_dir / name)
+                sitemap = SitemapFile(publish_dir, URLSET_HEADER, URLSET_FOOTER)
+            sitemap.write(element, lastmod)
+
+        if not parts:
+            finish(sitemap, publish_dir / "sitemap.xml")
+            return written
+
+        name = f"sitemap-{len(parts) + 1}.xml"
+        parts.append((name, sitemap.lastmod))
+        finish(sitemap, publish_dir / name)
+        sitemap = SitemapFile(publish_dir, INDEX_HEADER, INDEX_FOOTER)
+        for name, lastmod in parts:
+            sitemap.write(entry("sitemap", f"{SITE_URL}/{name}", lastmod))
+        finish(sitemap, publish_dir / "sitemap.xml")
+        return written
+    except BaseException:
+        sitemap.discard()
+        raise
@@ -0,0 +1,25 @@
+document.addEventListener('DOMContentLoaded', () => {
+    // Add a copy button to every code block; highlighting itself happens at build time
+    document.querySelectorAll('pre > code').forEach(code => {
+        const pre = code.parentNode;
+        const wrapper = document.createElement('div');
+        wrapper.className = 'code-block';
+        pre.parentNode.insertBefore(wrapper, pre);
+        wrapper.appendChild(pre);
+
+        const button = document.createElement('button');
+        button.type = 'button';
+        button.className = 'copy-code-button';
+        button.textContent = 'Copy';
+        button.addEventListener('click', async () => {
+            try {
+                await navigator.clipboard.writeText(code.innerText);
+                button.textContent = 'Copied!';
+            } catch (e) {
+                button.textContent = 'Failed';
+            }
+            setTimeout(() => { button.textContent = 'Copy'; }, 2000);
+        });
+        wrapper.appendChild(button);
+    });
+});
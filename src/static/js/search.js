@@ -0,0 +1,169 @@
+// Blog search over the index scripts/search.py writes to search/
+// Only meta.json, the shards of the query's terms and the document chunks of the results are fetched.
+// Shards and chunks are requested with meta.json's token, which changes with every index update, so a
+// browser never pairs a cached shard with a newer chunk (document ids are reused) or the other way round
+document.addEventListener('DOMContentLoaded', () => {
+    const form = document.querySelector('.blog-search');
+    if (!form) return;
+    const input = form.querySelector('input[type="search"]');
+    const results = form.querySelector('.search-results');
+    const root = form.dataset.root || '';
+    const base = `${root}/search`;
+
+    const cache = new Map();
+    const fetchOnce = (path, parse, options) => {
+        if (!cache.has(path)) {
+            cache.set(path, fetch(`${base}/${path}`, options).then(response => {
+                if (!response.ok) throw new Error(`${path}: ${response.status}`);
+                return parse(response);
+            }).catch(error => {
+                // Let the next keystroke try again
+                cache.delete(path);
+                throw error;
+            }));
+        }
+        return cache.get(path);
+    };
+    // Always revalidated, since it decides which versions of everything else are loaded
+    const loadMeta = () => fetchOnce('meta.json', response => response.json(), { cache: 'no-cache' });
+
+    // Same steps as tokenize() in scripts/search.py
+    const tokenize = (text, meta) => {
+        const stopwords = new Set(meta.stopwords);
+        const folded = text.normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+        return (folded.match(/[\p{L}\p{N}_]+/gu) || []).filter(token => {
+            const length = [...token].length;
+            return length >= meta.min_term_length
+                && length <= meta.max_term_length
+                && !stopwords.has(token)
+                && !(/^\d+$/.test(token) && length > 4);
+        });
+    };
+
+    const encoder = new TextEncoder();
+    const decoder = new TextDecoder();
+    const prefixOf = (term, meta) => [...term].slice(0, meta.shard_prefix_length).join('');
+    const shardName = (term, meta) => Array.from(
+        encoder.encode(prefixOf(term, meta)), byte => byte.toString(16).padStart(2, '0')
+    ).join('');
+
+    const decodeShard = (data, prefix) => {
+        let position = 0;
+        const varint = () => {
+            let value = 0;
+            let scale = 1;
+            for (;;) {
+                const byte = data[position++];
+                value += (byte & 0x7f) * scale;
+                if (byte < 0x80) return value;
+                scale *= 128;
+            }
+        };
+        const postings = new Map();
+        const count = varint();
+        for (let i = 0; i < count; i++) {
+            const length = varint();
+            const term = prefix + decoder.decode(data.subarray(position, position + length));
+            position += length;
+            const docs = new Map();
+            const entries = varint();
+            let doc = 0;
+            for (let j = 0; j < entries; j++) {
+                doc += varint();
+                docs.set(doc, varint());
+            }
+            postings.set(term, docs);
+        }
+        return postings;
+    };
+
+    const loadShard = (term, meta) => {
+        const name = shardName(term, meta);
+        if (!meta.shards.includes(name)) return Promise.resolve(new Map());
+        return fetchOnce(`terms/${name}.bin?v=${meta.token}`, async response =>
+            decodeShard(new Uint8Array(await response.arrayBuffer()), prefixOf(term, meta)));
+    };
+
+    const postings = async (term, prefix, meta) => {
+        const shard = await loadShard(term, meta);
+        if (!prefix) return shard.get(term) || new Map();
+        const merged = new Map();
+        for (const [candidate, docs] of shard) {
+            if (!candidate.startsWith(term)) continue;
+            for (const [doc, weight] of docs) {
+                merged.set(doc, Math.max(weight, merged.get(doc) || 0));
+            }
+        }
+        return merged;
+    };
+
+    // Mirrors SearchReader.search: every word must match, the last one as a prefix
+    const search = async (query, limit = 10) => {
+        const meta = await loadMeta();
+        const terms = tokenize(query, meta);
+        if (!terms.length) return [];
+
+        const lists = await Promise.all(terms.map((term, index) => postings(term, index === terms.length - 1, meta)));
+        let scores = null;
+        for (const list of lists) {
+            const idf = Math.log(1 + (meta.documents - list.size + 0.5) / (list.size + 0.5));
+            const next = new Map();
+            for (const [doc, weight] of list) {
+                if (scores === null) next.set(doc, weight * idf);
+                else if (scores.has(doc)) next.set(doc, scores.get(doc) + weight * idf);
+            }
+            scores = next;
+            if (!scores.size) return [];
+        }
+
+        const best = [...scores].sort((a, b) => b[1] - a[1] || a[0] - b[0]).slice(0, limit);
+        return Promise.all(best.map(async ([doc]) => {
+            const chunk = await fetchOnce(
+                `docs/${Math.floor(doc / meta.doc_chunk_size)}.json?v=${meta.token}`, response => response.json()
+            );
+            const [url, title] = chunk[doc];
+            return { url, title };
+        }));
+    };
+
+    const render = (items, query) => {
+        results.replaceChildren();
+        if (!query.trim()) {
+            results.hidden = true;
+            return;
+        }
+        if (!items.length) {
+            const empty = document.createElement('li');
+            empty.className = 'search-empty';
+            empty.textContent = 'No posts found';
+            results.appendChild(empty);
+        }
+        for (const { url, title } of items) {
+            const item = document.createElement('li');
+            const link = document.createElement('a');
+            link.href = `${root}${url}`;
+            link.textContent = title;
+            item.appendChild(link);
+            results.appendChild(item);
+        }
+        results.hidden = false;
+    };
+
+    let timer = null;
+    let latest = 0;
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(async () => {
+            const query = input.value;
+            const request = ++latest;
+            try {
+                const items = await search(query);
+                // Answers can arrive out of order; only the last query's is shown
+                if (request === latest) render(items, query);
+            } catch (e) {
+                if (request === latest) render([], query);
+            }
+        }, 150);
+    });
+    form.addEventListener('submit', event => event.preventDefault());
+});
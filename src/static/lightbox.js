@@ -13,11 +13,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Add wrappers and expand icons to all article images inside p tags
     document.querySelectorAll('article p img').forEach(img => {
-        // Create wrapper
+        // Create wrapper, keeping responsive images inside their <picture>
+        const target = img.closest('picture') || img;
         const wrapper = document.createElement('span');
         wrapper.className = 'article-image-wrapper';
-        img.parentNode.insertBefore(wrapper, img);
-        wrapper.appendChild(img);
+        target.parentNode.insertBefore(wrapper, target);
+        wrapper.appendChild(target);
 
         // Create expand icon
         const icon = document.createElement('span');
@@ -28,7 +29,13 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Open lightbox on icon or image click
         function openLightbox() {
-            const clone = img.cloneNode();
+            // The srcsets are on the <picture>'s <source>s, so those need the new sizes too
+            const clone = target.cloneNode(true);
+            const cloneImg = clone.tagName === 'IMG' ? clone : clone.querySelector('img');
+            // Pick the largest candidate for the full-screen view
+            clone.querySelectorAll('source').forEach(source => { source.sizes = '100vw'; });
+            cloneImg.sizes = '100vw';
+            cloneImg.removeAttribute('loading');
             lightbox.innerHTML = '';
             lightbox.appendChild(clone);
             lightbox.classList.add('active');